@@ -41,6 +41,21 @@ DATABASES = {
         'NAME': os.path.join(os.path.dirname(__file__), 'db.sqlite3'),
     }
 }
+
+
+# Cache
+# https://docs.djangoproject.com/en/dev/topics/cache/
+#
+# The cache has to be shared by all processes because it holds the versions
+# of the cached pages. Use memcached if the processes run on several hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(os.path.dirname(__file__), 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
 """
 
 
@@ -0,0 +1,73 @@
+import csv
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ophrys.accounts.models import User
+
+
+class Command(BaseCommand):
+    """
+    Command to import users from a CSV file.
+    """
+    args = '<csv file>'
+    help = ('Imports users from a CSV file with the columns email, password (optional) and time_zone (optional). '
+            'Use - to read from stdin. All users are imported in one transaction.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000, help='Number of rows read and saved at once. Default: 1000'),
+        make_option('--processes', type='int', default=None, help='Number of processes to hash passwords. Default: one per CPU'),
+        make_option('--hasher', default='default', help='Name of the password hasher, e. g. a faster one for many users.'))
+    columns = ('email', 'password', 'time_zone')
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Enter the path of the CSV file.')
+        if args[0] == '-':
+            count = self.import_users(sys.stdin, **options)
+        else:
+            with open(args[0], newline='', encoding='utf-8') as csv_file:
+                count = self.import_users(csv_file, **options)
+        self.stdout.write('%d users successfully imported.' % count)
+
+    def import_users(self, csv_file, batch_size, processes, hasher, **options):
+        """
+        Reads the rows in batches so that the memory usage does not depend
+        on the size of the file. The passwords of all batches are hashed by
+        one pool of processes, which is created before the transaction.
+        Returns the number of imported users.
+        """
+        if processes == 1:
+            return self.import_batches(csv_file, batch_size, hasher, executor=None)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return self.import_batches(csv_file, batch_size, hasher, executor=executor)
+
+    def import_batches(self, csv_file, batch_size, hasher, executor):
+        """
+        Saves all rows batch by batch in one transaction. Returns the number
+        of imported users.
+        """
+        count = 0
+        batch = []
+        with transaction.atomic():
+            for row in csv.DictReader(csv_file):
+                batch.append(dict((column, row[column]) for column in self.columns if row.get(column)))
+                if len(batch) >= batch_size:
+                    count += self.save_batch(batch, count, hasher, executor)
+                    batch = []
+            if batch:
+                count += self.save_batch(batch, count, hasher, executor)
+        return count
+
+    def save_batch(self, batch, count, hasher, executor):
+        """
+        Saves one batch of users. Without executor the passwords are hashed
+        in the current process. Returns the number of saved users.
+        """
+        try:
+            User.objects.bulk_create_users(batch, processes=1, hasher=hasher, executor=executor)
+        except ValueError as error:
+            raise CommandError('Error in the rows %d to %d: %s' % (count + 1, count + len(batch), error))
+        return len(batch)
@@ -0,0 +1,19 @@
+import pytz
+from django.utils import timezone
+
+
+class TimeZoneMiddleware:
+    """
+    Middleware to activate the time zone of the current user for the
+    request. Anonymous users and users without a time zone get the default
+    time zone. Add it after Django's AuthenticationMiddleware.
+    """
+    def process_request(self, request):
+        time_zone_name = getattr(getattr(request, 'user', None), 'time_zone', '')
+        if time_zone_name:
+            try:
+                timezone.activate(pytz.timezone(time_zone_name))
+            except pytz.UnknownTimeZoneError:
+                timezone.deactivate()
+        else:
+            timezone.deactivate()
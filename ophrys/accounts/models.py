@@ -1,6 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pytz
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager, Group,
                                         PermissionsMixin)
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import models, transaction
 from django.utils import timezone
 
 from ophrys.utils.models import GetAbsoluteUrlMixin
@@ -13,10 +20,12 @@ class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         """
         Creates and saves an user with the given email and password.
+        Raises ValueError if the email is already used, ignoring the case.
         """
         if not email:
             raise ValueError('The given email must be set.')
         email = UserManager.normalize_email(email)
+        self.check_emails_unused([email])
         user = self.model(email=email,
                           last_login=timezone.now(),
                           **extra_fields)
@@ -32,14 +41,117 @@ class UserManager(BaseUserManager):
                                 is_superuser=is_superuser,
                                 **extra_fields)
 
+    def get_by_natural_key(self, email):
+        """
+        Returns the user with the given email ignoring the case. This is
+        used by the authentication backend and is one indexed lookup.
+        """
+        return self.get(normalized_email=email.lower())
+
+    def check_emails_unused(self, emails):
+        """
+        Raises ValueError if one of the given emails is already used,
+        ignoring the case. This costs one query.
+        """
+        existing_emails = self.filter(
+            normalized_email__in=[email.lower() for email in emails]).values_list('email', flat=True)[:1]
+        if existing_emails:
+            raise ValueError('The email "%s" is already used.' % existing_emails[0])
+
+    def bulk_create_users(self, users, processes=None, hasher='default', batch_size=500, executor=None):
+        """
+        Creates and saves many users at once. The argument users is an
+        iterable of dictionaries with the email, the password (optional)
+        and other fields.
+
+        All emails are normalized and validated before any password is
+        hashed. Raises ValueError if an email is missing, invalid, given
+        twice or already used, ignoring the case. The passwords are hashed in parallel, see
+        hash_passwords(). The other fields are validated like in forms, so
+        ValueError is raised too if a field is unknown or its value is
+        invalid, e. g. an unknown time zone. The users are inserted with
+        bulk_create() in one transaction, so no signals are sent. Returns the
+        list of users.
+        """
+        users = list(users)
+        field_names = set(field.name for field in self.model._meta.fields)
+        last_login = timezone.now()
+        emails = []
+        seen_emails = set()
+        user_objects = []
+        for user in users:
+            if not user.get('email'):
+                raise ValueError('The given email must be set.')
+            email = UserManager.normalize_email(user['email'])
+            try:
+                validate_email(email)
+            except ValidationError:
+                raise ValueError('The email "%s" is invalid.' % email)
+            if email.lower() in seen_emails:
+                raise ValueError('The email "%s" is given twice.' % email)
+            seen_emails.add(email.lower())
+            emails.append(email)
+            extra_fields = dict((key, value) for key, value in user.items() if key not in ('email', 'password'))
+            for name in sorted(extra_fields):
+                if name not in field_names:
+                    raise ValueError('The field "%s" is unknown.' % name)
+            user_object = self.model(email=email, normalized_email=email.lower(), last_login=last_login, **extra_fields)
+            try:
+                user_object.clean_fields(exclude=['password'])
+            except ValidationError as error:
+                field = self.model._meta.get_field(sorted(error.message_dict)[0])
+                raise ValueError('The %s "%s" is invalid.' % (field.verbose_name, field.value_from_object(user_object)))
+            user_objects.append(user_object)
+        for start in range(0, len(emails), batch_size):
+            self.check_emails_unused(emails[start:start + batch_size])
+        passwords = hash_passwords([user.get('password') for user in users], processes=processes, hasher=hasher, executor=executor)
+        for user_object, password in zip(user_objects, passwords):
+            user_object.password = password
+        with transaction.atomic(using=self._db):
+            self.bulk_create(user_objects, batch_size=batch_size)
+        return user_objects
+
+
+def hash_passwords(passwords, processes=None, hasher='default', executor=None):
+    """
+    Returns a list of the hashes of the given passwords. Empty passwords get
+    an unusable hash.
+
+    The passwords are hashed by a pool of processes, by default one per CPU.
+    With processes=1 they are hashed in the current process. Callers which
+    hash many lists may give an executor instead, which is used instead of
+    a new pool. The hasher may be the name of a faster hasher from
+    PASSWORD_HASHERS, e. g. for provisioning many users. These hashes are
+    replaced by hashes of the default hasher when the users log in the first
+    time.
+    """
+    hash_password = partial(make_password, hasher=hasher)
+    passwords = [password or None for password in passwords]
+    if len(passwords) < 2 or (executor is None and processes == 1):
+        return [hash_password(password) for password in passwords]
+    if executor is not None:
+        return list(executor.map(hash_password, passwords))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(hash_password, passwords))
+
 
 class User(GetAbsoluteUrlMixin, PermissionsMixin, AbstractBaseUser):
     """
     Custom user model.
     """
     email = models.EmailField(max_length=254, unique=True, db_index=True)
+    normalized_email = models.CharField(max_length=254, unique=True, editable=False)
+    """
+    The email in lowercase for lookups ignoring the case. It is set on
+    save. Two users can not have emails which differ only in case.
+    """
     is_active = models.BooleanField(default=True)  # blank=True
     date_joined = models.DateTimeField(auto_now_add=True)
+    time_zone = models.CharField(max_length=63, blank=True, choices=[(name, name) for name in pytz.common_timezones])
+    """
+    Time zone of the user, e. g. 'Europe/Berlin'. The default time zone is
+    used if it is empty.
+    """
 
     objects = UserManager()
 
@@ -49,6 +161,30 @@ class User(GetAbsoluteUrlMixin, PermissionsMixin, AbstractBaseUser):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        """
+        Sets the normalized email and saves the user.
+        """
+        self.normalized_email = self.email.lower()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['normalized_email']
+        return super().save(*args, **kwargs)
+
+    def validate_unique(self, exclude=None):
+        """
+        Checks also that no other user has an email which differs only in
+        case. The normalized email is not editable, so forms skip its unique
+        check.
+        """
+        super().validate_unique(exclude=exclude)
+        if self.email and (exclude is None or 'email' not in exclude):
+            other_users = User.objects.filter(normalized_email=self.email.lower())
+            if self.pk is not None:
+                other_users = other_users.exclude(pk=self.pk)
+            if other_users.exists():
+                raise ValidationError({'email': ['The email "%s" is already used.' % self.email]})
+
     def get_full_name(self):
         return 'Full name: %s' % self.email
 
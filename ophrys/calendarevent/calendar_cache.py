@@ -0,0 +1,94 @@
+import datetime
+
+from django.utils.timezone import utc
+
+from ophrys.utils.cache import get_version, renew_versions
+
+
+CALENDAR_CACHE_PREFIX = 'ophrys.calendarevent.calendar'
+"""
+Prefix of all keys of the calendar cache in Django's cache backend.
+"""
+
+ALL_MONTHS = None
+"""
+Marker for recurring events which may touch every month.
+"""
+
+
+def get_month_version_key(year, month):
+    """
+    Returns the key of the version of a month.
+    """
+    return '%s:version:%d-%d' % (CALENDAR_CACHE_PREFIX, year, month)
+
+
+def get_cache_key(year, month, time_zone_name, language):
+    """
+    Returns the key of a rendered month. It contains the version of all
+    months and the version of the month itself, so changing one of them
+    invalidates the rendered month.
+    """
+    return '%s:%s:%s:%d-%d:%s:%s' % (
+        CALENDAR_CACHE_PREFIX,
+        get_version('%s:version' % CALENDAR_CACHE_PREFIX),
+        get_version(get_month_version_key(year, month)),
+        year,
+        month,
+        time_zone_name,
+        language)
+
+
+def invalidate_months(months):
+    """
+    Invalidates the rendered months given as set of (year, month) tuples
+    in all time zones and languages. Invalidates all months if ALL_MONTHS is
+    given.
+    """
+    if months is ALL_MONTHS:
+        renew_versions('%s:version' % CALENDAR_CACHE_PREFIX)
+    else:
+        renew_versions(*[get_month_version_key(year, month) for year, month in months])
+
+
+def get_event_months(event):
+    """
+    Returns a set of (year, month) tuples of all months the event overlaps
+    in any time zone. Returns ALL_MONTHS for recurring events.
+    """
+    if event.recurrence:
+        return ALL_MONTHS
+    # One day before and after covers the offsets of all time zones.
+    first_day = (event.begin - datetime.timedelta(days=1)).astimezone(utc).date()
+    last_day = ((event.end or event.begin) + datetime.timedelta(days=1)).astimezone(utc).date()
+    months = set()
+    year, month = first_day.year, first_day.month
+    while (year, month) <= (last_day.year, last_day.month):
+        months.add((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def remember_old_event_months(sender, instance, **kwargs):
+    """
+    Receiver to remember the months of the stored version of an event before
+    it is changed, so that they can be invalidated too. It is connected in
+    the models module, so this module does not import the models.
+    """
+    if instance.pk is not None:
+        old_event = sender._default_manager.filter(pk=instance.pk).first()
+        if old_event is not None:
+            instance._old_calendar_months = get_event_months(old_event)
+
+
+def invalidate_event_months(sender, instance, **kwargs):
+    """
+    Receiver to invalidate all rendered months the event overlaps. It is
+    connected in the models module too.
+    """
+    months = get_event_months(instance)
+    old_months = instance.__dict__.pop('_old_calendar_months', set())
+    if months is ALL_MONTHS or old_months is ALL_MONTHS:
+        invalidate_months(ALL_MONTHS)
+    else:
+        invalidate_months(months | old_months)
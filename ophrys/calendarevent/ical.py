@@ -0,0 +1,196 @@
+import datetime
+
+from django.utils.timezone import get_default_timezone, localtime, now, utc
+
+
+TIME_ZONE_RANGE = datetime.timedelta(days=10 * 365)
+"""
+Time after the begin of a recurring event without end, or after now if it
+begins earlier, for which the VTIMEZONE component defines the local times.
+"""
+
+
+def escape_text(value):
+    """
+    Returns the given text escaped for a TEXT value of iCalendar.
+    """
+    value = value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+    return value.replace('\r\n', '\n').replace('\r', '\n').replace('\n', '\\n')
+
+
+def fold_line(line):
+    """
+    Returns the given content line with CRLF at its end. Lines longer than 75
+    octets are folded without splitting multi-octet characters.
+    """
+    parts = []
+    part = ''
+    part_length = 0
+    for character in line:
+        character_length = len(character.encode('utf-8'))
+        if part_length + character_length > 75:
+            parts.append(part)
+            # The leading space of the continuation line counts too.
+            part = ' '
+            part_length = 1
+        part += character
+        part_length += character_length
+    parts.append(part)
+    return '\r\n'.join(parts) + '\r\n'
+
+
+def format_datetime(value):
+    """
+    Returns the given aware datetime as UTC date-time of iCalendar.
+    """
+    return value.astimezone(utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def format_utc_offset(offset):
+    """
+    Returns the given UTC offset as UTC-OFFSET value of iCalendar.
+    """
+    minutes = int(offset.total_seconds()) // 60
+    return '%s%02d%02d' % ('-' if minutes < 0 else '+', abs(minutes) // 60, abs(minutes) % 60)
+
+
+def get_time_zone_state(time_zone, value):
+    """
+    Returns the UTC offset, the daylight saving time offset and the name of
+    the given time zone at the given aware datetime.
+    """
+    local_value = localtime(value, time_zone)
+    return local_value.utcoffset(), local_value.dst(), local_value.tzname()
+
+
+def iter_time_zone_changes(time_zone, start, end):
+    """
+    Generator for the changes of the state of the given time zone, see
+    get_time_zone_state(), between the given aware datetimes. Yields tuples of
+    the UTC datetime of the change and the states before and after it. The
+    state is checked once a day and the change is then searched to the
+    second, so a change which is undone within one day is not found.
+    """
+    step = datetime.timedelta(days=1)
+    value = start.astimezone(utc).replace(microsecond=0)
+    state = get_time_zone_state(time_zone, value)
+    while value < end:
+        next_value = min(value + step, end)
+        next_state = get_time_zone_state(time_zone, next_value)
+        if next_state != state:
+            low, high = value, next_value
+            while high - low > datetime.timedelta(seconds=1):
+                middle = low + datetime.timedelta(seconds=int((high - low).total_seconds()) // 2)
+                if get_time_zone_state(time_zone, middle) == state:
+                    low = middle
+                else:
+                    high = middle
+            yield high, state, get_time_zone_state(time_zone, high)
+        value, state = next_value, next_state
+
+
+def get_time_zone_lines(time_zone, start, end):
+    """
+    Returns a list of the folded content lines of the VTIMEZONE component of
+    the given pytz time zone. It contains the last change of the UTC offset
+    within a year before the given aware start and all changes until the
+    given aware end, so all local times between them are defined. Only the
+    public methods of tzinfo are used to find the changes.
+    """
+    changes = list(iter_time_zone_changes(time_zone, start - datetime.timedelta(days=366), end))
+    earlier_changes = [change for change in changes if change[0] <= start]
+    if earlier_changes:
+        changes = changes[len(earlier_changes) - 1:]
+    else:
+        # The offset has not changed for a year, so the first observance
+        # simply begins at the start.
+        state = get_time_zone_state(time_zone, start)
+        changes.insert(0, (start, state, state))
+    lines = ['BEGIN:VTIMEZONE', 'TZID:%s' % time_zone.zone]
+    for change, state_from, (offset_to, dst, name) in changes:
+        offset_from = state_from[0]
+        component = 'DAYLIGHT' if dst else 'STANDARD'
+        lines.extend((
+            'BEGIN:%s' % component,
+            'DTSTART:%s' % (change.astimezone(utc).replace(tzinfo=None) + offset_from).strftime('%Y%m%dT%H%M%S'),
+            'TZOFFSETFROM:%s' % format_utc_offset(offset_from),
+            'TZOFFSETTO:%s' % format_utc_offset(offset_to),
+            'TZNAME:%s' % name,
+            'END:%s' % component))
+    lines.append('END:VTIMEZONE')
+    return [fold_line(line) for line in lines]
+
+
+def get_event_lines(event, stamp):
+    """
+    Returns a list of the folded content lines of the VEVENT component of
+    the given event. Recurring events are written in the default time zone
+    because they keep their local time across daylight saving time. Their
+    VTIMEZONE component comes from get_time_zone_lines().
+    """
+    lines = ['BEGIN:VEVENT', 'UID:ophrys-event-%d' % event.pk, 'DTSTAMP:%s' % stamp]
+    if event.recurrence:
+        time_zone = get_default_timezone()
+        lines.append('DTSTART;TZID=%s:%s' % (time_zone.zone, localtime(event.begin, time_zone).strftime('%Y%m%dT%H%M%S')))
+        rule = 'FREQ=%s' % event.recurrence.upper()
+        if event.recurrence_interval:
+            rule += ';INTERVAL=%d' % event.recurrence_interval
+        if event.recurrence_until:
+            rule += ';UNTIL=%s' % format_datetime(event.recurrence_until)
+        lines.append('RRULE:%s' % rule)
+    else:
+        lines.append('DTSTART:%s' % format_datetime(event.begin))
+    if event.duration:
+        lines.append('DURATION:PT%dM' % event.duration)
+    lines.append('SUMMARY:%s' % escape_text(event.title))
+    if event.text:
+        lines.append('DESCRIPTION:%s' % escape_text(event.text))
+    lines.append('END:VEVENT')
+    return [fold_line(line) for line in lines]
+
+
+def get_cancelled_event_lines(event_deletion, stamp):
+    """
+    Returns a list of the content lines of a cancelled VEVENT component for
+    the given deleted event.
+    """
+    return [fold_line(line) for line in (
+        'BEGIN:VEVENT',
+        'UID:ophrys-event-%d' % event_deletion.event_id,
+        'DTSTAMP:%s' % stamp,
+        'DTSTART:%s' % format_datetime(event_deletion.begin),
+        'STATUS:CANCELLED',
+        'END:VEVENT')]
+
+
+def iter_calendar(events, event_deletions=()):
+    """
+    Generator for the content lines of an iCalendar object with the given
+    events and the given deleted events as cancelled events. They are
+    consumed one by one, so they may be iterators over huge querysets. The
+    VTIMEZONE component of the recurring events therefore follows the
+    events, which iCalendar allows. It covers the time from the first begin
+    until the last possible begin of the recurring events.
+    """
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield 'VERSION:2.0\r\n'
+    yield 'PRODID:-//Ophrys//Ophrys//EN\r\n'
+    current_time = now()
+    stamp = format_datetime(current_time)
+    first_recurring_begin = last_recurring_until = None
+    for event in events:
+        if event.recurrence:
+            if first_recurring_begin is None or event.begin < first_recurring_begin:
+                first_recurring_begin = event.begin
+            until = event.recurrence_until or max(event.begin, current_time) + TIME_ZONE_RANGE
+            if last_recurring_until is None or until > last_recurring_until:
+                last_recurring_until = until
+        for line in get_event_lines(event, stamp):
+            yield line
+    for event_deletion in event_deletions:
+        for line in get_cancelled_event_lines(event_deletion, stamp):
+            yield line
+    if first_recurring_begin is not None:
+        for line in get_time_zone_lines(get_default_timezone(), first_recurring_begin, last_recurring_until):
+            yield line
+    yield 'END:VCALENDAR\r\n'
@@ -1,11 +1,47 @@
 import datetime
 
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.timezone import get_default_timezone, localtime, now
 from django.utils.translation import ugettext_lazy
 
-from ophrys.core.models import TaggedModel
+from ophrys.core.models import TaggedManager, TaggedModel
 from ophrys.utils.models import AutoModelMixin
 
+from .calendar_cache import invalidate_event_months, remember_old_event_months
+from .ical import iter_calendar
+from .recurrence import RECURRENCE_CHOICES, iter_recurrences
+
+
+class EventManager(TaggedManager):
+    """
+    Custom manager for events.
+    """
+    def overlapping(self, start, end):
+        """
+        Returns a queryset of all events which may overlap the interval
+        between start and end. This includes events which began before start
+        and all recurring series which may have an occurrence in the
+        interval. Use get_occurrences() to get the exact occurrences.
+
+        This is one query on the index of begin and last_end.
+        """
+        return self.filter(begin__lt=end).filter(Q(last_end__isnull=True) | Q(last_end__gte=start))
+
+    def get_occurrences(self, start, end):
+        """
+        Returns a list of all occurrences of all events in the interval
+        between start and end, sorted by their begin. Recurring series are
+        expanded only for this interval.
+        """
+        occurrences = []
+        for event in self.overlapping(start, end):
+            occurrences.extend(event.get_occurrences(start, end))
+        occurrences.sort(key=lambda occurrence: occurrence.begin)
+        return occurrences
+
 
 class Event(AutoModelMixin, TaggedModel):
     """
@@ -23,20 +59,88 @@ class Event(AutoModelMixin, TaggedModel):
 
     begin = models.DateTimeField()
     """
-    Begin of the event. You can set date and time.
+    Begin of the event. You can set date and time. For recurring events
+    this is the begin of the first occurrence.
     """
 
     duration = models.IntegerField(null=True, blank=True, help_text=ugettext_lazy('Duration of the event in minutes'))
     """
-    Duration of the event in minutes.
+    Duration of the event in minutes. This field is optional.
+    """
+
+    recurrence = models.CharField(max_length=10, blank=True, choices=RECURRENCE_CHOICES)
+    """
+    Frequency of a recurring event. The event does not recur if it is empty.
+    """
+
+    recurrence_interval = models.PositiveIntegerField(
+        null=True, blank=True, help_text=ugettext_lazy('E. g. 2 for every second week. Default is 1.'))
+    """
+    Interval of the recurrence. This field is optional.
+    """
+
+    recurrence_until = models.DateTimeField(null=True, blank=True, help_text=ugettext_lazy('Last possible begin of the event'))
+    """
+    End of the recurrence. The event recurs infinitely if it is empty.
+    """
+
+    last_end = models.DateTimeField(null=True, editable=False)
+    """
+    End of the last occurrence of the event. It is empty for recurring
+    events without end of the recurrence. It is set on save, so that the
+    events which overlap an interval are found by their begin and their
+    last end, see EventManager.overlapping().
     """
 
+    last_modified = models.DateTimeField(auto_now=True, db_index=True)
+    """
+    Time of the last change of the event. It is set automaticly.
+    """
+
+    objects = EventManager()
+
+    export_formats = ('csv', 'jsonl', 'ics')
+
     class Meta:
         ordering = ('begin',)
+        index_together = (('begin', 'last_end'),)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        """
+        Sets the end of the last occurrence and saves the event.
+        """
+        self.last_end = self.get_last_end()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = list(update_fields) + ['last_end']
+        return super().save(*args, **kwargs)
+
+    def get_last_end(self):
+        """
+        Returns the end of the last occurrence of the event or None if the
+        event recurs infinitely. For recurring events this is the end of an
+        occurrence beginning at the end of the recurrence, which is never
+        earlier than the end of the real last occurrence.
+        """
+        if not self.recurrence:
+            last_begin = self.begin
+        elif self.recurrence_until is not None:
+            last_begin = self.recurrence_until
+        else:
+            return None
+        return last_begin + datetime.timedelta(minutes=self.duration or 0)
+
+    @classmethod
+    def iter_ical(cls, events):
+        """
+        Generator for the content lines of an iCalendar object with the given
+        events. Used by the export view.
+        """
+        return iter_calendar(events)
+
     @property
     def end(self):
         """
@@ -44,3 +148,131 @@ class Event(AutoModelMixin, TaggedModel):
         """
         if self.duration:
             return self.begin + datetime.timedelta(minutes=self.duration)
+
+    def get_occurrences(self, start, end):
+        """
+        Generator for all occurrences of the event which overlap the interval
+        between start and end, see get_occurrence_begins().
+        """
+        for begin in get_occurrence_begins(
+                self.begin, self.duration, self.recurrence, self.recurrence_interval, self.recurrence_until, start, end):
+            yield Occurrence(event=self, begin=begin)
+
+
+class EventDeletion(models.Model):
+    """
+    Model for a deleted event. The iCalendar feed sends deleted events to
+    clients which only fetch the changes since their last request. Deleted
+    events older than max_age are removed, so clients whose last request is
+    older get the full feed.
+    """
+    max_age = datetime.timedelta(days=90)
+    """
+    Time how long deleted events are kept.
+    """
+
+    event_id = models.PositiveIntegerField()
+    """
+    Primary key of the deleted event.
+    """
+
+    begin = models.DateTimeField()
+    """
+    Begin of the deleted event.
+    """
+
+    deleted = models.DateTimeField(auto_now_add=True, db_index=True)
+    """
+    Time of the deletion.
+    """
+
+    def __str__(self):
+        return 'Deleted event %d' % self.event_id
+
+
+class Occurrence:
+    """
+    Simple class for one occurrence of an event.
+    """
+    def __init__(self, event, begin):
+        self.event = event
+        self.begin = begin
+
+    def __str__(self):
+        return str(self.event)
+
+    @property
+    def title(self):
+        return self.event.title
+
+    @property
+    def end(self):
+        """
+        Returns the end time of the occurrence according to the duration of
+        the event.
+        """
+        if self.event.duration:
+            return self.begin + datetime.timedelta(minutes=self.event.duration)
+
+    def get_absolute_url(self, *args, **kwargs):
+        return self.event.get_absolute_url(*args, **kwargs)
+
+
+def get_occurrence_begins(begin, duration, recurrence, recurrence_interval, recurrence_until, start, end):
+    """
+    Generator for the begins of all occurrences of an event which overlap the
+    interval between start and end. The other arguments are the values of
+    the fields of the event, so this works with values() too. An occurrence
+    without duration overlaps if it begins in the interval. Recurring events
+    recur in the default time zone, so they keep their local time across
+    daylight saving time.
+    """
+    duration = datetime.timedelta(minutes=duration or 0)
+    if not recurrence:
+        begins = [begin]
+    else:
+        time_zone = get_default_timezone()
+        begins = (
+            make_aware(value, time_zone) for value in iter_recurrences(
+                first=make_naive(begin, time_zone),
+                frequency=recurrence,
+                interval=recurrence_interval or 1,
+                until=make_naive(recurrence_until, time_zone) if recurrence_until else None,
+                after=make_naive(start - duration, time_zone)))
+    for begin in begins:
+        if begin >= end:
+            break
+        if begin >= start or begin + duration > start:
+            yield begin
+
+
+def make_naive(value, time_zone):
+    """
+    Returns the given aware datetime as naive local time in the given time
+    zone.
+    """
+    return localtime(value, time_zone).replace(tzinfo=None)
+
+
+def make_aware(value, time_zone):
+    """
+    Returns the given naive local time as aware datetime. Other than
+    django.utils.timezone.make_aware() this does not fail for ambiguous or
+    non-existent local times during the change of daylight saving time.
+    """
+    return time_zone.normalize(time_zone.localize(value))
+
+
+@receiver(post_delete, sender=Event, dispatch_uid='event_deletion_post_delete')
+def remember_event_deletion(sender, instance, **kwargs):
+    """
+    Stores the deletion of an event for the iCalendar feed and removes the
+    deleted events older than EventDeletion.max_age.
+    """
+    EventDeletion.objects.filter(deleted__lt=now() - EventDeletion.max_age).delete()
+    EventDeletion.objects.create(event_id=instance.pk, begin=instance.begin)
+
+
+pre_save.connect(remember_old_event_months, sender=Event, dispatch_uid='calendar_cache_event_pre_save')
+post_save.connect(invalidate_event_months, sender=Event, dispatch_uid='calendar_cache_event_post_save')
+post_delete.connect(invalidate_event_months, sender=Event, dispatch_uid='calendar_cache_event_post_delete')
@@ -0,0 +1,75 @@
+import calendar
+import datetime
+
+from django.utils.translation import ugettext_lazy
+
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+YEARLY = 'yearly'
+
+RECURRENCE_CHOICES = (
+    (DAILY, ugettext_lazy('Daily')),
+    (WEEKLY, ugettext_lazy('Weekly')),
+    (MONTHLY, ugettext_lazy('Monthly')),
+    (YEARLY, ugettext_lazy('Yearly')))
+"""
+Frequencies of recurring events, similar to the FREQ part of an iCalendar
+RRULE.
+"""
+
+
+def add_months(value, months):
+    """
+    Returns the given datetime shifted by the given number of months. Returns
+    None if the day does not exist in the resulting month, e. g. February 30.
+    """
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    if value.day > calendar.monthrange(year, month)[1]:
+        return None
+    return value.replace(year=year, month=month)
+
+
+def iter_recurrences(first, frequency, interval=1, until=None, after=None):
+    """
+    Generator for the begins of all occurrences of a recurring series in
+    chronological order.
+
+    The argument first is the begin of the first occurrence. The series ends
+    with the last begin before or at until. Without until the series is
+    infinite, so only take as many values as you need. Begins before after
+    are skipped without computing them one by one. All datetimes have to be
+    naive local times. Like RRULE, monthly and yearly series skip months
+    which do not have the day of the first occurrence.
+    """
+    if frequency in (DAILY, WEEKLY):
+        step = datetime.timedelta(days=interval * (7 if frequency == WEEKLY else 1))
+        index = 0
+        if after is not None and after > first:
+            index = (after - first) // step
+        while True:
+            value = first + index * step
+            index += 1
+            if until is not None and value > until:
+                return
+            if after is None or value >= after:
+                yield value
+    elif frequency in (MONTHLY, YEARLY):
+        months = interval * (12 if frequency == YEARLY else 1)
+        index = 0
+        if after is not None and after > first:
+            index = ((after.year - first.year) * 12 + after.month - first.month) // months
+        while True:
+            value = add_months(first, index * months)
+            index += 1
+            if value is None:
+                continue
+            if until is not None and value > until:
+                return
+            if after is None or value >= after:
+                yield value
+    else:
+        raise ValueError('The frequency "%s" is unknown.' % frequency)
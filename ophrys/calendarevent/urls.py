@@ -1,19 +1,18 @@
 import datetime
 
 from django.conf.urls import patterns, include, url
-from django.utils.timezone import now
 
 from .models import Event
-from .views import Calendar
+from .views import Calendar, EventFeed, EventICalFeed
 
 
 urlpatterns = patterns(
     '',
     # Calendar
-    url(r'^$', Calendar.as_view(),
-        {'year': str(now().year), 'month': str(now().month)},  # TODO: Use users local time instead of UTC
-        name='calendar_default'),
+    url(r'^$', Calendar.as_view(), name='calendar_default'),
     url(r'^(?P<year>\d+)-(?P<month>\d+)/$', Calendar.as_view(), name='calendar'),
+    url(r'^feed/$', EventFeed.as_view(), name='event_feed'),
+    url(r'^feed\.ics$', EventICalFeed.as_view(), name='ical_feed'),
 
     # Event
-    url(r'^event/', include(Event().urls)))
+    url(r'^event/', include(Event.urls)))
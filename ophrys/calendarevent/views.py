@@ -1,16 +1,30 @@
-from calendar import HTMLCalendar as _HTMLCalendar
+import datetime
+import json
+from calendar import HTMLCalendar as _HTMLCalendar, monthrange
 
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
 from django.utils.safestring import mark_safe
-from django.utils.timezone import localtime
+from django.utils.timezone import get_current_timezone, get_current_timezone_name, is_naive, localtime, now, utc
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
 
-from ophrys.utils.views import MonthArchiveView
+from ophrys.utils.cache import get_model_last_modified
+from ophrys.utils.models import get_pk_url, get_pk_url_template
+from ophrys.utils.views import ConditionalViewMixin, ExportView, ModelConditionalViewMixin, MonthArchiveView, View
 
-from .models import Event
+from .calendar_cache import get_cache_key
+from .ical import format_datetime, iter_calendar
+from .models import Event, EventDeletion, get_occurrence_begins, make_aware
 
 
-class Calendar(MonthArchiveView):
+class Calendar(ConditionalViewMixin, MonthArchiveView):
     """
-    View to show one month of the calendar with the events in it.
+    View to show one month of the calendar with the events in it. The ETag
+    contains the key of the rendered month, so it changes with the events
+    of the month.
     """
     model = Event
     date_field = 'begin'
@@ -19,13 +33,79 @@ class Calendar(MonthArchiveView):
     allow_future = True
     template_name = 'calendarevent/calendar.html'
 
-    def get_context_data(self, *args, **kwargs):
+    def get_dated_items(self):
         """
-        Inserts the HTML calendar into the template context.
+        Returns the occurrences of all events which overlap the month
+        instead of the events which begin in the month. Recurring events are
+        expanded only for this month.
         """
-        context = super().get_context_data(*args, **kwargs)
-        context['html_calendar'] = mark_safe(HTMLCalendar(view_instance=self).formatmonth(int(self.get_year()), int(self.get_month())))
-        return context
+        month = '%s-%s' % (self.get_year(), self.get_month())
+        try:
+            date = datetime.datetime.strptime(month, '%s-%s' % (self.get_year_format(), self.get_month_format())).date()
+        except ValueError:
+            raise Http404('Invalid month "%s".' % month)
+        if date.month == 12:
+            next_month = datetime.date(date.year + 1, 1, 1)
+        else:
+            next_month = datetime.date(date.year, date.month + 1, 1)
+        time_zone = get_current_timezone()
+        since = make_aware(datetime.datetime.combine(date, datetime.time.min), time_zone)
+        until = make_aware(datetime.datetime.combine(next_month, datetime.time.min), time_zone)
+        occurrences = Event.objects.get_occurrences(since, until)
+        date_list = sorted(set(localtime(occurrence.begin).date() for occurrence in occurrences))
+        return (date_list, occurrences, {
+            'month': date,
+            'next_month': self.get_next_month(date),
+            'previous_month': self.get_previous_month(date)})
+
+    def get_year(self):
+        """
+        Returns the year of the url or the current year in the current time
+        zone.
+        """
+        try:
+            return super().get_year()
+        except Http404:
+            return str(localtime(now()).year)
+
+    def get_month(self):
+        """
+        Returns the month of the url or the current month in the current time
+        zone.
+        """
+        try:
+            return super().get_month()
+        except Http404:
+            return str(localtime(now()).month)
+
+    def get_etag_parts(self):
+        return super().get_etag_parts() + [self.get_cache_key()]
+
+    def get_cache_key(self):
+        """
+        Returns the key of the rendered month in the current time zone and
+        language.
+        """
+        return get_cache_key(int(self.get_year()), int(self.get_month()), get_current_timezone_name(), get_language())
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns the calendar. The rendered month and the previous and next
+        month are cached per time zone and language. On a cache hit no
+        events are loaded, so object_list and date_list stay empty.
+        """
+        cache_key = self.get_cache_key()
+        calendar_context = cache.get(cache_key)
+        if calendar_context is None:
+            self.date_list, self.object_list, calendar_context = self.get_dated_items()
+            calendar_context['html_calendar'] = mark_safe(
+                HTMLCalendar(view_instance=self).formatmonth(int(self.get_year()), int(self.get_month())))
+            cache.set(cache_key, calendar_context)
+        else:
+            self.date_list, self.object_list = [], []
+        context = self.get_context_data(object_list=self.object_list, date_list=self.date_list)
+        context.update(calendar_context)
+        return self.render_to_response(context)
 
 
 class HTMLCalendar(_HTMLCalendar):
@@ -36,6 +116,14 @@ class HTMLCalendar(_HTMLCalendar):
         self.view_instance = view_instance
         return super().__init__(*args, **kwargs)
 
+    def formatmonth(self, theyear, themonth, *args, **kwargs):
+        """
+        Returns a month as a table. Groups all events by their local days
+        before the table is built.
+        """
+        self.day_index = self.get_day_index(theyear, themonth)
+        return super().formatmonth(theyear, themonth, *args, **kwargs)
+
     def formatday(self, day, weekday):
         """
         Returns a day as a table cell.
@@ -47,11 +135,160 @@ class HTMLCalendar(_HTMLCalendar):
         else:
             return '<td class="%s">%s</td>' % (self.cssclasses[weekday], self.get_day_content(day))
 
+    def get_day_index(self, year, month):
+        """
+        Returns a dictionary with the days of the month as keys and lists of
+        links to the events of these days as values. Events lasting several
+        days are linked on each of these days. The local time of each
+        occurrence and the url of each event are computed only once.
+        """
+        day_index = {}
+        urls = {}
+        first_of_month = datetime.date(year, month, 1)
+        last_of_month = datetime.date(year, month, monthrange(year, month)[1])
+        for occurrence in self.view_instance.object_list:  # Check whether there is another var than object_list
+            event = occurrence.event
+            if event.pk not in urls:
+                urls[event.pk] = event.get_absolute_url()
+            link = '<a href="%(url)s">%(title)s</a>' % {'title': event.title, 'url': urls[event.pk]}
+            day = localtime(occurrence.begin).date()
+            last_day = localtime(occurrence.end - datetime.timedelta.resolution).date() if occurrence.end else day
+            day, last_day = max(day, first_of_month), min(last_day, last_of_month)
+            while day <= last_day:
+                day_index.setdefault(day.day, []).append(link)
+                day += datetime.timedelta(days=1)
+        return day_index
+
     def get_day_content(self, day):
-        event_list = []
-        for event in self.view_instance.object_list:  # Check whether there is another var than object_list
-            if localtime(event.begin).day == day:
-                event_list.append(
-                    '<a href="%(url)s">%(title)s</a>' % {'title': event.title,
-                                                         'url': event.get_absolute_url()})
-        return '%d %s' % (day, ' '.join(event_list))
+        return '%d %s' % (day, ' '.join(self.day_index.get(day, [])))
+
+
+class EventFeed(View):
+    """
+    View to get all occurrences in the interval between the query parameters
+    'start' and 'end' as JSON list for client-side calendars. The parameters
+    are dates or datetimes in ISO 8601 format, naive values are in the
+    current time zone. Each occurrence is an object with the id, the title,
+    the begin, the end and the url of its event. The times are in UTC.
+
+    The events are loaded with values() instead of model instances. The
+    response has an ETag and a Last-Modified header according to the last
+    change of any event, so clients can revalidate it without any database
+    query.
+    """
+    max_days = 366
+    fields = ('id', 'title', 'begin', 'duration', 'recurrence', 'recurrence_interval', 'recurrence_until')
+
+    @method_decorator(condition(
+        etag_func=lambda request, *args, **kwargs: get_model_last_modified(Event).isoformat(),
+        last_modified_func=lambda request, *args, **kwargs: get_model_last_modified(Event)))
+    def get(self, request, *args, **kwargs):
+        start = self.parse_parameter('start')
+        end = self.parse_parameter('end')
+        if start is None or end is None or not start < end <= start + datetime.timedelta(days=self.max_days):
+            return HttpResponseBadRequest('The parameters start and end are missing or invalid.')
+        return HttpResponse(json.dumps(self.get_occurrences(start, end)), content_type='application/json')
+
+    def parse_parameter(self, name):
+        """
+        Returns the query parameter with the given name as aware datetime.
+        Returns None if it is missing or invalid.
+        """
+        value = self.request.GET.get(name, '')
+        try:
+            parsed_value = parse_datetime(value)
+            if parsed_value is None:
+                parsed_date = parse_date(value)
+                if parsed_date is None:
+                    return None
+                parsed_value = datetime.datetime.combine(parsed_date, datetime.time())
+        except ValueError:
+            return None
+        if is_naive(parsed_value):
+            parsed_value = make_aware(parsed_value, get_current_timezone())
+        return parsed_value
+
+    def get_occurrences(self, start, end):
+        """
+        Returns the list of the occurrences as dictionaries sorted by begin.
+        """
+        full_url_name = Event.get_absolute_url_name()
+        url_template = get_pk_url_template(full_url_name)
+        occurrences = []
+        for event in Event.objects.overlapping(start, end).values(*self.fields):
+            url = get_pk_url(full_url_name, url_template, event['id'])
+            duration = datetime.timedelta(minutes=event['duration'] or 0)
+            for begin in get_occurrence_begins(
+                    event['begin'], event['duration'], event['recurrence'], event['recurrence_interval'], event['recurrence_until'],
+                    start, end):
+                occurrences.append((begin, event['id'], event['title'], begin + duration if event['duration'] else None, url))
+        occurrences.sort(key=lambda occurrence: occurrence[:2])
+        return [{
+            'id': event_id,
+            'title': title,
+            'begin': begin.astimezone(utc).isoformat(),
+            'end': end.astimezone(utc).isoformat() if end is not None else None,
+            'url': url} for begin, event_id, title, end, url in occurrences]
+
+
+class EventICalFeed(ModelConditionalViewMixin, ExportView):
+    """
+    View to subscribe to the calendar with iCalendar clients. The feed is
+    streamed.
+
+    With the query parameter 'since' only the events changed since then and
+    the events deleted since then (as cancelled events) are sent. The value
+    for the next request is sent in the header X-Sync-Token. It is a bit
+    earlier than the request, so changes which are committed during the
+    request are sent again instead of being missed. Values older than
+    EventDeletion.max_age get the full feed because older deleted events
+    are removed. The header X-Sync-Full marks every full feed.
+    """
+    model = Event
+    sync_token_overlap = datetime.timedelta(minutes=5)
+    since = None
+
+    def get(self, request, *args, **kwargs):
+        sync_token = format_datetime(now() - self.sync_token_overlap)
+        if request.GET.get('since'):
+            since = self.parse_since(request.GET['since'])
+            if since is None:
+                return HttpResponseBadRequest('The parameter since is invalid.')
+            if since >= now() - EventDeletion.max_age:
+                self.since = since
+        response = super().get(request, format='ics')
+        response['Content-Disposition'] = 'inline; filename="calendar.ics"'
+        response['X-Sync-Token'] = sync_token
+        if self.since is None:
+            response['X-Sync-Full'] = 'true'
+        return response
+
+    def parse_since(self, value):
+        """
+        Returns the given sync token or ISO 8601 datetime as aware datetime.
+        Returns None if it is invalid.
+        """
+        try:
+            return datetime.datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=utc)
+        except ValueError:
+            pass
+        try:
+            since = parse_datetime(value)
+        except ValueError:
+            return None
+        if since is not None and is_naive(since):
+            since = make_aware(since, get_current_timezone())
+        return since
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.since is not None:
+            queryset = queryset.filter(last_modified__gte=self.since)
+        return queryset
+
+    def iter_ical(self):
+        events = self.iter_chunked(self.get_queryset(), lambda event: event.pk)
+        if self.since is None:
+            return iter_calendar(events)
+        event_deletions = self.iter_chunked(EventDeletion.objects.filter(deleted__gte=self.since), lambda event_deletion: event_deletion.pk)
+        return iter_calendar(events, event_deletions)
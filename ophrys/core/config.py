@@ -1,27 +1,39 @@
 from django import forms
+from django.core.signals import request_started
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext_lazy as _
+
+from ophrys.utils.cache import get_version, invalidate_pages, renew_versions
 
 from .models import ConfigStore
 from .signals import get_config_groups
 
 
+CONFIG_CACHE_VERSION_KEY = 'ophrys.core.config.version'
+"""
+Key in Django's cache backend which holds the version of the config cache.
+Every worker compares it with the version of its own process-local cache.
+"""
+
+
 class Config:
     """
     Container class for all config variables.
 
     The several variables are attributes of an instance of this class.
+    All customized variables are loaded at once into a process-local cache.
+    The cache is reloaded when another process (or this one) has changed
+    the version in Django's cache backend. The version is read only once
+    per request, so the lookups of variables cost no round trip to the
+    cache backend.
     """
     def __getattr__(self, key):
         try:
             return self._cache(key)
         except TypeError:
-            # The key is not in the cache.
-            pass
-        try:
-            return self._database(key)
-        except TypeError:
-            # The key is not in the database
+            # The key is not in the cache and therefor not in the database.
             pass
         try:
             default_value = get_default_value(key)
@@ -30,20 +42,123 @@ class Config:
         return default_value
 
     def __setattr__(self, key, value):
-        updated_rows = ConfigStore.objects.filter(key=key).update(value=value)
-        if not updated_rows:
-            ConfigStore.objects.create(key=key, value=value)
+        """
+        Saves the variable in the database. The unique key of ConfigStore
+        makes this an atomic upsert: If the insert fails, the existing row
+        is updated.
+        """
+        try:
+            with transaction.atomic():
+                ConfigStore.objects.create(key=key, value=value)
+        except IntegrityError:
+            # The variable already exists in the database.
+            ConfigStore.objects.filter(key=key).update(value=value)
+        invalidate_config_cache()
 
-    def _cache(self, key):
-        # The cache does not exist at the moment.
-        raise TypeError
+    def update_many(self, mapping):
+        """
+        Saves all variables of the given dictionary in one transaction.
+
+        Variables whose values equal the stored values or, if they are not
+        stored, the default values are skipped. Changed stored variables
+        are updated in place with one query, new variables are inserted with
+        one query. The config cache is invalidated once. If another process stores one of
+        the new variables concurrently, they are saved one by one instead.
+        """
+        changed_values = {}
+        changed_stored_values = {}
+        new_config_stores = []
+        try:
+            with transaction.atomic():
+                stored_values = dict(
+                    (config_store.key, config_store.value)
+                    for config_store in ConfigStore.objects.filter(key__in=list(mapping)))
+                for key, value in mapping.items():
+                    if key in stored_values:
+                        if value == stored_values[key]:
+                            continue
+                        changed_stored_values[key] = value
+                    else:
+                        try:
+                            if value == get_default_value(key):
+                                continue
+                        except TypeError:
+                            # The variable has no default value.
+                            pass
+                        new_config_stores.append(ConfigStore(key=key, value=value))
+                    changed_values[key] = value
+                # The update keeps the primary keys and sends no signals which
+                # would invalidate the cache per key.
+                ConfigStore.objects.update_values(changed_stored_values)
+                ConfigStore.objects.bulk_create(new_config_stores)
+        except IntegrityError:
+            # Another process has stored one of the variables in the meantime,
+            # so save them one by one.
+            for key, value in changed_values.items():
+                setattr(self, key, value)
+        else:
+            if changed_values:
+                invalidate_config_cache()
 
-    def _database(self, key):
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the values of all given variables. Stored
+        values are taken from the cache, which costs at most one query, the
+        other values from the default config variables.
+        """
+        cache_store = self._get_cache_store()
+        values = {}
+        for key in keys:
+            try:
+                values[key] = cache_store[key]
+            except KeyError:
+                try:
+                    values[key] = get_default_value(key)
+                except TypeError as error_message:
+                    raise AttributeError(error_message)
+        return values
+
+    def _cache(self, key):
+        """
+        Returns the value of the variable from the process-local cache.
+        Raises TypeError if the key is not in the cache.
+        """
         try:
-            return ConfigStore.objects.get(key=key).value
-        except ConfigStore.DoesNotExist:
+            return self._get_cache_store()[key]
+        except KeyError:
             raise TypeError
 
+    def _get_cache_store(self):
+        """
+        Returns the process-local cache, a dictionary with all variables
+        stored in the database. Reloads it if it is out of date. The version
+        is only read again after _check_cache_version() was called.
+        """
+        if not self.__dict__.get('_cache_version_checked'):
+            version = get_version(CONFIG_CACHE_VERSION_KEY)
+            if version is None or version != self.__dict__.get('_cache_version'):
+                # Set the store before the version so that other threads never
+                # see the new version together with the old store.
+                self.__dict__['_cache_store'] = self._database()
+                self.__dict__['_cache_version'] = version
+            self.__dict__['_cache_version_checked'] = version is not None
+        return self.__dict__['_cache_store']
+
+    def _check_cache_version(self):
+        """
+        Lets the next lookup compare the version of the process-local cache
+        with the version in Django's cache backend.
+        """
+        self.__dict__['_cache_version_checked'] = False
+
+    def _database(self):
+        """
+        Returns a dictionary with all variables stored in the database.
+        """
+        # Use model instances instead of values_list() so that the JSONField
+        # converts the values to Python objects.
+        return dict((config_store.key, config_store.value) for config_store in ConfigStore.objects.all())
+
 
 config = Config()
 """
@@ -52,6 +167,26 @@ serveral variables are attributes of this object.
 """
 
 
+def invalidate_config_cache():
+    """
+    Function to invalidate the config cache in all processes. The ETags of
+    all pages are invalidated too because they may show config variables.
+    """
+    renew_versions(CONFIG_CACHE_VERSION_KEY)
+    config._check_cache_version()
+    invalidate_pages()
+
+
+@receiver(request_started, dispatch_uid='config_request_started')
+def check_config_cache_version(sender, **kwargs):
+    """
+    Checks the version of the config cache once at the beginning of every
+    request, so that changes of other processes are seen by the next
+    request.
+    """
+    config._check_cache_version()
+
+
 class ConfigVariable:
     """
     Simple class for a default config variable.
@@ -104,28 +239,120 @@ class ConfigGroup:
                 return False
 
 
+class ConfigRegistry:
+    """
+    Registry of all config groups and an index of all config variables.
+
+    The groups are collected from the receivers of the get_config_groups
+    signal on first use. They are collected again only if a receiver is
+    connected or disconnected.
+    """
+    def __init__(self):
+        self._receivers_version = None
+        self._groups = []
+        self._variables = {}
+
+    def _update(self):
+        """
+        Collects all groups and builds the key index if the receivers of the
+        get_config_groups signal have changed.
+        """
+        receivers_version = get_config_groups.receivers_version
+        if receivers_version != self._receivers_version:
+            groups = [group for receiver, group in get_config_groups.send(sender='config_registry')]
+            variables = {}
+            for group in groups:
+                for variable in group:
+                    variables.setdefault(variable.key, variable)
+            self._groups = groups
+            self._variables = variables
+            self._receivers_version = receivers_version
+
+    @property
+    def groups(self):
+        """
+        Returns a list of all config groups.
+        """
+        self._update()
+        return self._groups
+
+    def __getitem__(self, key):
+        """
+        Returns the config variable with the given key. Raises KeyError if
+        it does not exist.
+        """
+        self._update()
+        return self._variables[key]
+
+    def __iter__(self):
+        """
+        Yields all config variables in the order of their groups.
+        """
+        for group in self.groups:
+            for variable in group:
+                yield variable
+
+
+config_registry = ConfigRegistry()
+"""
+Registry object. Entry point to get all config groups and the default config
+variables.
+"""
+
+
 def get_default_value(key):
     """
     Function to get the default value of a variable.
     """
-    config_groups_list = get_config_groups.send(sender='get_default_value_function')
-    for receiver, config_group in config_groups_list:
+    try:
+        return config_registry[key].value
+    except KeyError:
+        raise TypeError('Config variable %s does not exist' % key)
+
+
+class ConfigProxy:
+    """
+    Request-scoped lazy proxy for the config object.
+
+    Every variable is resolved via the config object at most once. All
+    lookups of variables are counted for profiling, see get_lookup_count().
+    """
+    def __init__(self):
+        self._values = {}
+        self._lookup_count = 0
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            # Private attributes and special methods are no config variables.
+            raise AttributeError(key)
+        self._lookup_count += 1
         try:
-            value = config_group[key].value
+            return self._values[key]
         except KeyError:
-            continue
-        else:
+            value = self._values[key] = getattr(config, key)
             return value
-    else:
-        raise TypeError('Config variable %s does not exist' % key)
+
+
+def get_lookup_count(config_proxy):
+    """
+    Returns the number of lookups of variables via the given config proxy
+    for profiling. It is no attribute of the proxy because every public
+    attribute would hide a config variable with the same name.
+    """
+    return config_proxy._lookup_count
 
 
 def context_processor(request):
     """
-    This puts the config object into every RequestContext. It has to be set in
-    the TEMPLATE_CONTEXT_PROCESSORS setting.
+    This puts a proxy for the config object into every RequestContext. It has
+    to be set in the TEMPLATE_CONTEXT_PROCESSORS setting. The proxy is bound
+    to the request as request.config_proxy.
     """
-    return {'config': config}
+    try:
+        config_proxy = request.config_proxy
+    except AttributeError:
+        config_proxy = request.config_proxy = ConfigProxy()
+    return {'config': config_proxy}
 
 
 @receiver(get_config_groups, dispatch_uid='general_config_variables')
@@ -135,3 +362,13 @@ def general_config_variables(sender, **kwargs):
                                   value='Name of your Organisation',
                                   label='Name of the Organisation'),),
         title=_('General settings'))
+
+
+@receiver(post_save, sender=ConfigStore, dispatch_uid='config_store_post_save')
+@receiver(post_delete, sender=ConfigStore, dispatch_uid='config_store_post_delete')
+def config_store_changed(sender, **kwargs):
+    """
+    Invalidates the config cache if a ConfigStore object is saved or deleted
+    without using the config object.
+    """
+    invalidate_config_cache()
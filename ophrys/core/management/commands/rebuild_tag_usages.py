@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+
+from ophrys.core.tags import rebuild_tag_usages
+
+
+class Command(NoArgsCommand):
+    """
+    Command to rebuild the tag usage counters from scratch.
+    """
+    help = 'Rebuilds all tag usage counters from the tag connections, e. g. after bulk imports.'
+
+    def handle_noargs(self, **options):
+        rebuild_tag_usages()
+        self.stdout.write('Tag usage counters successfully rebuilt.')
@@ -1,26 +1,79 @@
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connections, IntegrityError, models, router, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy
 
 from jsonfield import JSONField
 
+from ophrys.utils.cache import renew_versions
+
+
+TAG_CLOUD_VERSION_KEY = 'ophrys.core.tags.version'
+"""
+Key in Django's cache backend which holds the version of the cached tag
+clouds and the tag indexes. It is renewed whenever a tag or a tag usage
+counter changes.
+"""
+
+TAG_INDEX_VERSION_KEY = 'ophrys.core.tags.index_version'
+"""
+Key in Django's cache backend which holds the version of the tag indexes.
+It is renewed only if tags are renamed or deleted or all counters are
+rebuilt. Other changes are loaded into the tag indexes one by one.
+"""
+
+
+class ConfigStoreManager(models.Manager):
+    """
+    Custom manager for customized config variables.
+    """
+    def update_values(self, values):
+        """
+        Updates the stored variables of the given dictionary of keys and
+        values with one query. Django has no conditional expressions, so the
+        UPDATE with a CASE over the keys is written by hand. No signals are
+        sent.
+        """
+        if not values:
+            return
+        connection = connections[router.db_for_write(self.model)]
+        quote_name = connection.ops.quote_name
+        key_column = quote_name(self.model._meta.get_field('key').column)
+        value_field = self.model._meta.get_field('value')
+        params = []
+        for key, value in values.items():
+            params.extend((key, value_field.get_db_prep_save(value, connection)))
+        params.extend(values)
+        connection.cursor().execute('UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+            quote_name(self.model._meta.db_table),
+            quote_name(value_field.column),
+            key_column,
+            ' '.join(['WHEN %s THEN %s'] * len(values)),
+            key_column,
+            ', '.join(['%s'] * len(values))), params)
+
 
 class ConfigStore(models.Model):
     """
     Model to store customized config variables in the database.
     """
-    key = models.CharField(max_length=255)
+    key = models.CharField(max_length=255, unique=True)
     value = JSONField()
 
+    objects = ConfigStoreManager()
+
 
 class Tag(models.Model):
     """
     Model for tags.
     """
-    name = models.CharField(max_length=255, help_text=ugettext_lazy('Maximum 255 characters'))
+    name = models.CharField(max_length=255, unique=True, help_text=ugettext_lazy('Maximum 255 characters'))
     """
-    Name of the tag, a string up to 255 characters.
+    Name of the tag, a unique string up to 255 characters.
     """
 
     class Meta:
@@ -30,10 +83,17 @@ class Tag(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        if not self.name.isalnum():
-            raise TypeError("A tag's name should contain only alphanumeric characters.")
+        self.check_name(self.name)
         return super().save(*args, **kwargs)
 
+    @staticmethod
+    def check_name(name):
+        """
+        Raises TypeError if the given name is not a valid name of a tag.
+        """
+        if not name.isalnum():
+            raise TypeError("A tag's name should contain only alphanumeric characters.")
+
 
 class TagConnection(models.Model):
     """
@@ -46,6 +106,69 @@ class TagConnection(models.Model):
 
     class Meta:
         ordering = ('tag',)
+        index_together = (('content_type', 'object_id'), ('tag', 'content_type'))
+
+
+class TagUsage(models.Model):
+    """
+    Denormalized counter of the objects of one model (content type) which
+    are tagged with one tag. The counters are updated by add_tag_usages()
+    and rebuilt by ophrys.core.tags.rebuild_tag_usages().
+    """
+    tag = models.ForeignKey(Tag)
+    content_type = models.ForeignKey(ContentType)
+    count = models.PositiveIntegerField(default=0)
+
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    """
+    Time of the last change of the counter. The tag indexes load the
+    counters changed since their last update.
+    """
+
+    class Meta:
+        unique_together = (('tag', 'content_type'),)
+
+
+class TaggedQuerySet(models.query.QuerySet):
+    """
+    Custom queryset for taggable models.
+    """
+    def with_tags(self):
+        """
+        Returns a queryset which loads all tags of all its objects in two
+        further queries. The method get_tags() of the objects then serves
+        the tags from memory.
+        """
+        return self.prefetch_related('tag_connections__tag')
+
+    def tagged_with(self, all=None, any=None):
+        """
+        Returns a queryset of all objects which are tagged with all tags of
+        the first argument and with at least one tag of the second argument.
+        The tags can be tag objects or names. Every tag of the first argument
+        becomes one join over the indexes of TagConnection and Tag, so the
+        database never scans all tag connections.
+        """
+        queryset = self
+        for name in set(get_tag_names(all or [])):
+            queryset = queryset.filter(tag_connections__tag__name=name)
+        if any:
+            queryset = queryset.filter(tag_connections__tag__name__in=set(get_tag_names(any)))
+        return queryset.distinct()
+
+
+class TaggedManager(models.Manager):
+    """
+    Custom manager for taggable models.
+    """
+    def get_queryset(self):
+        return TaggedQuerySet(self.model, using=self._db)
+
+    def with_tags(self):
+        return self.get_queryset().with_tags()
+
+    def tagged_with(self, *args, **kwargs):
+        return self.get_queryset().tagged_with(*args, **kwargs)
 
 
 class TaggedModel(models.Model):
@@ -54,20 +177,204 @@ class TaggedModel(models.Model):
     """
     tag_connections = generic.GenericRelation(TagConnection)
 
+    objects = TaggedManager()
+
     class Meta:
         abstract = True
 
     def get_tags(self):
         """
         Generator method to get all tags this model instance is tagged with.
+        Uses the tags loaded by with_tags() if the instance comes from such a
+        queryset.
         """
-        for tag_connection in self.tag_connections.select_related('tag').all():
+        tag_connections = self.tag_connections.all()
+        if 'tag_connections' not in getattr(self, '_prefetched_objects_cache', {}):
+            tag_connections = tag_connections.select_related('tag')
+        for tag_connection in tag_connections:
             yield tag_connection.tag
 
     def add_tag(self, tag):
         """
-        Method to add a tag to an instance of this model.
+        Method to add a tag to an instance of this model. The tag can be a tag
+        object or a name. Nothing happens if the instance already has it.
+        """
+        bulk_tag([self], [tag])
+
+    def add_tags(self, tags):
+        """
+        Method to add several tags to an instance of this model. The tags can
+        be tag objects or names. Tags the instance already has are skipped.
         """
-        if isinstance(tag, str):
-            tag, created = Tag.objects.get_or_create(name=tag)
-        TagConnection.objects.create(tag=tag, content_object=self)
+        bulk_tag([self], tags)
+
+    def set_tags(self, tags):
+        """
+        Method to replace all tags of an instance of this model with the
+        given tags. The tags can be tag objects or names.
+        """
+        with transaction.atomic():
+            tags = get_or_create_tags(tags)
+            TagConnection.objects.filter(
+                content_type=ContentType.objects.get_for_model(self),
+                object_id=self.pk).exclude(tag__in=tags).delete()
+            bulk_tag([self], tags)
+
+
+def get_tag_names(tags):
+    """
+    Generator for the names of the given tags, which can be tag objects or
+    names.
+    """
+    for tag in tags:
+        yield tag.name if isinstance(tag, Tag) else tag
+
+
+def get_or_create_tags(tags):
+    """
+    Returns a list of tag objects for the given tags, which can be tag
+    objects or names. All names are looked up in one query. Missing tags
+    are created in bulk. If another process creates one of them
+    concurrently, they are created one by one with get_or_create() instead.
+    """
+    tags = list(tags)
+    tag_objects = dict((tag.pk, tag) for tag in tags if isinstance(tag, Tag))
+    names = set(tag for tag in tags if isinstance(tag, str))
+    if names:
+        for name in names:
+            Tag.check_name(name)
+        existing_tags = list(Tag.objects.filter(name__in=names))
+        missing_names = names - set(tag.name for tag in existing_tags)
+        if missing_names:
+            try:
+                with transaction.atomic():
+                    Tag.objects.bulk_create([Tag(name=name) for name in missing_names])
+            except IntegrityError:
+                for name in missing_names:
+                    Tag.objects.get_or_create(name=name)
+            # Fetch the tags again to get the primary keys of the new ones.
+            existing_tags = list(Tag.objects.filter(name__in=names))
+        tag_objects.update((tag.pk, tag) for tag in existing_tags)
+    return list(tag_objects.values())
+
+
+def bulk_tag(objects, tags):
+    """
+    Function to tag all given objects with all given tags in one transaction.
+    The objects can be instances of different taggable models. The tags can
+    be tag objects or names. Existing tag connections are skipped. Apart
+    from tag usage counters used for the first time, the number of queries
+    depends only on the number of different models.
+    """
+    with transaction.atomic():
+        tags = get_or_create_tags(tags)
+        objects_by_content_type = {}
+        for tagged_object in objects:
+            content_type = ContentType.objects.get_for_model(tagged_object)
+            objects_by_content_type.setdefault(content_type, []).append(tagged_object)
+            # Drop the tags loaded by with_tags() because they are outdated.
+            getattr(tagged_object, '_prefetched_objects_cache', {}).pop('tag_connections', None)
+        new_tag_connections = []
+        for content_type, tagged_objects in objects_by_content_type.items():
+            existing_pairs = set(TagConnection.objects.filter(
+                content_type=content_type,
+                object_id__in=set(tagged_object.pk for tagged_object in tagged_objects),
+                tag__in=tags).values_list('tag_id', 'object_id'))
+            for tagged_object in tagged_objects:
+                for tag in tags:
+                    if (tag.pk, tagged_object.pk) not in existing_pairs:
+                        existing_pairs.add((tag.pk, tagged_object.pk))
+                        new_tag_connections.append(
+                            TagConnection(tag=tag, content_type=content_type, object_id=tagged_object.pk))
+        TagConnection.objects.bulk_create(new_tag_connections)
+        # bulk_create() does not send the post_save signal, so update the
+        # counters here.
+        counts = {}
+        for tag_connection in new_tag_connections:
+            key = (tag_connection.tag_id, tag_connection.content_type_id)
+            counts[key] = counts.get(key, 0) + 1
+        add_tag_usages(counts)
+
+
+def invalidate_tag_cloud(reload_tag_index=False):
+    """
+    Function to invalidate all cached tag clouds in all processes. The tag
+    indexes load the changed tags or, if reload_tag_index is True, reload
+    all tags.
+    """
+    if reload_tag_index:
+        renew_versions(TAG_CLOUD_VERSION_KEY, TAG_INDEX_VERSION_KEY)
+    else:
+        renew_versions(TAG_CLOUD_VERSION_KEY)
+
+
+def add_tag_usages(counts):
+    """
+    Function to change the tag usage counters. The argument is a dictionary
+    with (tag id, content type id) tuples as keys and the numbers to add as
+    values. Negative numbers decrease the counters.
+
+    Existing counters are updated with one query per distinct number.
+    Missing counters are created with their numbers in one query. If
+    another process creates one of them concurrently, the missing counters
+    are created one by one with get_or_create() instead. Counters are never
+    created for negative numbers because their tag may be deleted at the
+    moment.
+    """
+    counts = dict((key, number) for key, number in counts.items() if number)
+    if not counts:
+        return
+    counter_ids = dict(
+        ((tag_id, content_type_id), counter_id) for counter_id, tag_id, content_type_id in TagUsage.objects.filter(
+            tag_id__in=set(tag_id for tag_id, content_type_id in counts),
+            content_type_id__in=set(content_type_id for tag_id, content_type_id in counts)).values_list(
+            'id', 'tag_id', 'content_type_id'))
+    missing_counts = dict((key, number) for key, number in counts.items() if key not in counter_ids and number > 0)
+    if missing_counts:
+        try:
+            with transaction.atomic():
+                TagUsage.objects.bulk_create([
+                    TagUsage(tag_id=tag_id, content_type_id=content_type_id, count=number)
+                    for (tag_id, content_type_id), number in missing_counts.items()])
+        except IntegrityError:
+            for tag_id, content_type_id in missing_counts:
+                counter_ids[(tag_id, content_type_id)] = TagUsage.objects.get_or_create(
+                    tag_id=tag_id, content_type_id=content_type_id)[0].pk
+        else:
+            # The new counters already have their numbers.
+            for key in missing_counts:
+                del counts[key]
+    counter_ids_by_number = {}
+    for key, number in counts.items():
+        if key in counter_ids:
+            counter_ids_by_number.setdefault(number, []).append(counter_ids[key])
+    for number, counter_id_list in counter_ids_by_number.items():
+        TagUsage.objects.filter(pk__in=counter_id_list).update(count=F('count') + number, modified=now())
+    invalidate_tag_cloud()
+
+
+@receiver(post_save, sender=TagConnection, dispatch_uid='tag_connection_post_save')
+def count_new_tag_connection(sender, instance, created, **kwargs):
+    """
+    Increases the tag usage counter if a tag connection is created.
+    """
+    if created:
+        add_tag_usages({(instance.tag_id, instance.content_type_id): 1})
+
+
+@receiver(post_delete, sender=TagConnection, dispatch_uid='tag_connection_post_delete')
+def count_deleted_tag_connection(sender, instance, **kwargs):
+    """
+    Decreases the tag usage counter if a tag connection is deleted.
+    """
+    add_tag_usages({(instance.tag_id, instance.content_type_id): -1})
+
+
+@receiver(post_save, sender=Tag, dispatch_uid='tag_post_save')
+@receiver(post_delete, sender=Tag, dispatch_uid='tag_post_delete')
+def tag_changed(sender, created=False, **kwargs):
+    """
+    Invalidates the tag clouds and tag indexes if a tag is saved or deleted.
+    New tags are loaded into the tag indexes without a complete reload.
+    """
+    invalidate_tag_cloud(reload_tag_index=not created)
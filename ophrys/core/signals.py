@@ -1,7 +1,29 @@
 from django.dispatch import Signal
 
 
-get_config_groups = Signal()
+class ConfigGroupsSignal(Signal):
+    """
+    Signal which counts all changes of its receivers. So the results of the
+    receivers can be cached until a receiver is connected or disconnected.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.receivers_version = 0
+
+    def connect(self, *args, **kwargs):
+        super().connect(*args, **kwargs)
+        self.receivers_version += 1
+
+    def disconnect(self, *args, **kwargs):
+        super().disconnect(*args, **kwargs)
+        self.receivers_version += 1
+
+    def _remove_receiver(self, *args, **kwargs):
+        super()._remove_receiver(*args, **kwargs)
+        self.receivers_version += 1
+
+
+get_config_groups = ConfigGroupsSignal()
 """
 Signal to get all config groups from all apps.
 """
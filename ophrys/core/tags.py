@@ -0,0 +1,140 @@
+import datetime
+import heapq
+from bisect import bisect_left
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils.timezone import now
+
+from ophrys.utils.cache import get_version, get_versions
+
+from .models import TAG_CLOUD_VERSION_KEY, TAG_INDEX_VERSION_KEY, invalidate_tag_cloud, Tag, TagConnection, TagUsage
+
+
+def rebuild_tag_usages():
+    """
+    Function to rebuild all tag usage counters from the tag connections,
+    e. g. after bulk imports which bypassed the counters.
+    """
+    with transaction.atomic():
+        TagUsage.objects.all().delete()
+        TagUsage.objects.bulk_create([
+            TagUsage(tag_id=row['tag'], content_type_id=row['content_type'], count=row['count'])
+            for row in TagConnection.objects.order_by().values('tag', 'content_type').annotate(count=Count('id'))])
+    invalidate_tag_cloud(reload_tag_index=True)
+
+
+def get_tag_cloud(model=None):
+    """
+    Returns a list of (tag name, count) tuples of all used tags sorted by
+    name. If a model is given, only objects of this model are counted. The
+    list is served from the counters and cached until a counter changes.
+    """
+    content_type = ContentType.objects.get_for_model(model) if model is not None else None
+    cache_key = 'ophrys.core.tags.cloud:%s:%s' % (get_version(TAG_CLOUD_VERSION_KEY), content_type.pk if content_type is not None else 'all')
+    tag_cloud = cache.get(cache_key)
+    if tag_cloud is None:
+        tag_usages = TagUsage.objects.filter(count__gt=0)
+        if content_type is not None:
+            tag_usages = tag_usages.filter(content_type=content_type)
+        counts = {}
+        for name, count in tag_usages.values_list('tag__name', 'count'):
+            counts[name] = counts.get(name, 0) + count
+        tag_cloud = sorted(counts.items())
+        cache.set(cache_key, tag_cloud)
+    return tag_cloud
+
+
+class TagIndex:
+    """
+    Process-local index of all tags for the search via prefix.
+
+    The index is a list of (lowercase name, name) tuples sorted by the
+    lowercase names, so all tags with a prefix are found via bisection. It
+    is loaded with one query on first use. If the version of the tag clouds
+    changes, only new tags and tags whose counters changed since the last
+    update are loaded. The index is reloaded completely only if the version
+    of the tag indexes changes, i. e. if tags are renamed or deleted.
+    """
+    update_overlap = datetime.timedelta(minutes=5)
+    """
+    Counters changed this long before the last update are loaded again
+    because their transactions may have been committed after it.
+    """
+
+    def __init__(self):
+        self._state = None
+
+    def _get_state(self):
+        """
+        Returns the state of the index, a tuple of the versions, the time of
+        the last update, the highest primary key of the tags, the entries
+        and the counts. Updates it if it is out of date. The state is
+        replaced as a whole, so other threads never see a mixed state.
+        """
+        state = self._state
+        versions = get_versions(TAG_CLOUD_VERSION_KEY, TAG_INDEX_VERSION_KEY)
+        if state is None or state[0][1] != versions[1]:
+            state = self._load(versions, now(), 0, [], {}, Tag.objects.all())
+        elif state[0][0] != versions[0]:
+            old_versions, updated, max_pk, entries, counts = state
+            changed_tag_ids = TagUsage.objects.filter(modified__gte=updated - self.update_overlap).values('tag_id')
+            state = self._load(versions, now(), max_pk, entries, counts,
+                               Tag.objects.filter(Q(pk__gt=max_pk) | Q(pk__in=changed_tag_ids)))
+        else:
+            return state
+        self._state = state
+        return state
+
+    def _load(self, versions, updated, max_pk, entries, counts, tags):
+        """
+        Returns a new state with the given tags loaded into the given
+        entries and counts, which are not changed.
+        """
+        counts = dict(counts)
+        new_entries = []
+        for pk, name, count in tags.annotate(count=Sum('tagusage__count')).values_list('pk', 'name', 'count'):
+            if name not in counts:
+                new_entries.append((name.lower(), name))
+            counts[name] = count or 0
+            max_pk = max(max_pk, pk)
+        if new_entries:
+            # The entries are sorted, so only the new ones have to be sorted
+            # before the merge in linear time.
+            entries = list(heapq.merge(entries, sorted(new_entries)))
+        return (versions, updated, max_pk, entries, counts)
+
+    def search(self, prefix, limit=10):
+        """
+        Returns a list of the names of the most used tags starting with the
+        given prefix, ignoring the case. Tags used equally often are sorted
+        by name.
+        """
+        prefix = prefix.lower()
+        versions, updated, max_pk, entries, counts = self._get_state()
+        start = bisect_left(entries, (prefix,))
+        end = bisect_left(entries, (prefix + '\U0010ffff',), start)
+        best_entries = heapq.nsmallest(limit, entries[start:end], key=lambda entry: (-counts[entry[1]], entry[0]))
+        return [name for key, name in best_entries]
+
+
+tag_index = TagIndex()
+"""
+Index object. Entry point for the search of tags via prefix.
+"""
+
+
+def get_tag_suggestions(prefix, model=None, limit=10):
+    """
+    Returns a list of the names of the most used tags starting with the
+    given prefix, ignoring the case. Without a model the suggestions come
+    from the tag index, with a model from the cached tag cloud of the model.
+    """
+    if model is None:
+        return tag_index.search(prefix, limit=limit)
+    prefix = prefix.lower()
+    suggestions = [(name, count) for name, count in get_tag_cloud(model) if name.lower().startswith(prefix)]
+    suggestions.sort(key=lambda suggestion: (-suggestion[1], suggestion[0]))
+    return [name for name, count in suggestions[:limit]]
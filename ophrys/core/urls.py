@@ -1,10 +1,11 @@
 from django.conf.urls import patterns, url
 from django.views.generic import TemplateView
 
-from .views import ConfigView
+from .views import ConfigView, TagAutocompleteView
 
 
 urlpatterns = patterns(
     '',
     url(r'^$', TemplateView.as_view(template_name='core/home.html'), name='home'),
-    url(r'^config/$', ConfigView.as_view(), name='config'))
+    url(r'^config/$', ConfigView.as_view(), name='config'),
+    url(r'^tags/autocomplete/$', TagAutocompleteView.as_view(), name='tag_autocomplete'))
@@ -1,9 +1,12 @@
+import json
+
 from django import forms
+from django.http import HttpResponse
 
-from ophrys.utils.views import FormView
+from ophrys.utils.views import FormView, View
 
-from .config import config
-from .signals import get_config_groups
+from .config import config, config_registry
+from .tags import tag_index
 
 
 class ConfigView(FormView):
@@ -19,7 +22,7 @@ class ConfigView(FormView):
         Gets all config groups and links them to this view.
         """
         return_value = super().__init__(*args, **kwargs)
-        self.config_groups = [group for receiver, group in get_config_groups.send(sender='config_view_class')]
+        self.config_groups = config_registry.groups
         return return_value
 
     def get_form(self, *args, **kwargs):
@@ -36,9 +39,8 @@ class ConfigView(FormView):
         """
         Generates the fields for the get_form() function.
         """
-        for config_group in self.config_groups:
-            for variable in config_group:
-                yield (variable.key, variable.form_field)
+        for variable in config_registry:
+            yield (variable.key, variable.form_field)
 
     def get_initial(self):
         """
@@ -46,16 +48,14 @@ class ConfigView(FormView):
         as intial value for the form.
         """
         initial = super().get_initial()
-        for key, field in self.generate_all_form_fields():
-            initial.update({key: getattr(config, key)})
+        initial.update(config.get_many(variable.key for variable in config_registry))
         return initial
 
     def form_valid(self, form):
         """
         Saves all data of a valid form.
         """
-        for key in form.cleaned_data:
-            setattr(config, key, form.cleaned_data[key])
+        config.update_many(form.cleaned_data)
         return super().form_valid(form)
 
     def get_context_data(self, *args, **kwargs):
@@ -65,3 +65,16 @@ class ConfigView(FormView):
         context = super().get_context_data(*args, **kwargs)
         context['config_groups'] = self.config_groups
         return context
+
+
+class TagAutocompleteView(View):
+    """
+    View to get the names of the most used tags starting with the prefix
+    given in the query parameter 'q' as JSON list. The names are served from
+    the tag index without any database query.
+    """
+    limit = 10
+
+    def get(self, request, *args, **kwargs):
+        names = tag_index.search(request.GET.get('q', ''), limit=self.limit)
+        return HttpResponse(json.dumps(names), content_type='application/json')
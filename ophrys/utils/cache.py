@@ -0,0 +1,109 @@
+import uuid
+import warnings
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.timezone import now
+
+
+def check_cache_backend(cache_backend=cache):
+    """
+    Warns if the given cache backend, by default Django's cache backend, is
+    not shared by all processes. The
+    versions and times of last changes in the cache tell the workers which
+    of their cached data and ETags are out of date, so with several workers
+    every worker has to see the same values.
+    """
+    if isinstance(cache_backend, (LocMemCache, DummyCache)):
+        warnings.warn(
+            'The cache backend %s is not shared by all processes. If you run several processes, set the CACHES '
+            'setting to a shared backend, e. g. memcached or the file based cache.' % type(cache_backend).__name__,
+            RuntimeWarning)
+
+
+def get_or_add(key, value):
+    """
+    Returns the value stored under the given key in Django's cache backend.
+    Stores the given value first if there is none. The value is read again
+    because another process may have added its value in the meantime.
+    """
+    stored_value = cache.get(key)
+    if stored_value is None:
+        # The key is added on first use, so check the backend now.
+        check_cache_backend()
+        cache.add(key, value, None)
+        stored_value = cache.get(key)
+    return stored_value
+
+
+def get_version(key):
+    """
+    Returns the version stored under the given key. Sets a new version if
+    there is none.
+    """
+    return get_or_add(key, uuid.uuid4().hex)
+
+
+def get_versions(*keys):
+    """
+    Returns a tuple of the versions stored under the given keys, read from
+    the cache backend at once. Sets new versions for missing keys.
+    """
+    versions = cache.get_many(keys)
+    return tuple(versions[key] if key in versions else get_version(key) for key in keys)
+
+
+def renew_versions(*keys):
+    """
+    Sets new versions under all given keys, so that all data cached with
+    the old versions is out of date in all processes.
+    """
+    cache.set_many(dict((key, uuid.uuid4().hex) for key in keys), None)
+
+
+PAGES_VERSION_KEY = 'ophrys.utils.cache.pages_version'
+"""
+Key in Django's cache backend which holds the version of all pages. It is
+part of the ETags of the conditional views.
+"""
+
+
+def get_pages_version():
+    """
+    Returns the version of all pages. Sets a new version if there is none.
+    """
+    return get_version(PAGES_VERSION_KEY)
+
+
+def invalidate_pages():
+    """
+    Function to invalidate the ETags of all pages, e. g. if something
+    changes which is shown on every page.
+    """
+    renew_versions(PAGES_VERSION_KEY)
+
+
+def get_last_modified_key(model):
+    """
+    Returns the key of the time of the last change of any object of the
+    given model.
+    """
+    return 'ophrys.utils.cache.last_modified:%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def get_model_last_modified(model):
+    """
+    Returns the time of the last change of any object of the given model. If
+    it is unknown, e. g. after the cache was cleared, the current time is
+    set.
+    """
+    return get_or_add(get_last_modified_key(model), now())
+
+
+def set_model_last_modified(model):
+    """
+    Sets the time of the last change of any object of the given model to
+    the current time.
+    """
+    cache.set(get_last_modified_key(model), now(), None)
@@ -1,8 +1,55 @@
+from django.conf import settings
 from django.conf.urls import patterns, url, include
-from django.core.urlresolvers import reverse, NoReverseMatch
+from django.core.urlresolvers import get_script_prefix, get_urlconf, reverse, NoReverseMatch
 from django.db import models
+from django.db.models.signals import class_prepared, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import get_language
 
-from .views import ListView, CreateView, DetailView, UpdateView, DeleteView
+from .cache import set_model_last_modified
+from .views import KeysetListView, CreateView, DetailView, UpdateView, DeleteView, ExportView, ModelConditionalViewMixin
+
+
+URL_TEMPLATE_PK = '314159265358979323846'
+"""
+Primary key used to reverse an url once to get a template for the urls of
+all objects of a model.
+"""
+
+absolute_url_cache = {}
+"""
+Dictionary with the resolved urls of GetAbsoluteUrlMixin. The keys are
+tuples of the model class, the url name, the url conf, the script prefix
+and the language. The values are tuples of the argument (None, 'pk' or
+'slug'), the full url name and the url template. The url template is the
+url itself for urls without argument, a format string for urls with pk
+argument and None for urls with slug argument.
+"""
+
+
+def get_pk_url_template(full_url_name):
+    """
+    Returns a format string for the url with the given full url name and a
+    pk argument, e. g. '/example/%d/'. Returns None if no template can be
+    built, e. g. because the url accepts only short primary keys, so
+    reverse() has to be used.
+    """
+    try:
+        url = reverse(full_url_name, kwargs={'pk': URL_TEMPLATE_PK})
+    except NoReverseMatch:
+        return None
+    if url.count(URL_TEMPLATE_PK) == 1:
+        return url.replace('%', '%%').replace(URL_TEMPLATE_PK, '%d')
+
+
+def get_pk_url(full_url_name, url_template, pk):
+    """
+    Returns the url with the given full url name for the given primary key.
+    Uses the url template from get_pk_url_template() if there is one.
+    """
+    if url_template is not None and isinstance(pk, int):
+        return url_template % pk
+    return reverse(full_url_name, kwargs={'pk': str(pk)})
 
 
 class GetAbsoluteUrlMixin:
@@ -16,6 +63,10 @@ class GetAbsoluteUrlMixin:
     `detail`, `update` or `delete`. So this mixin tries to reverse e. g.
     `yourproject.yourapp:YourModel:detail`. The named urls except `list`
     and `create` have to accept either a pk argument or a slug argument.
+
+    The full url name and the argument are resolved once per model and url
+    name. Urls with pk argument are then built from an url template without
+    calling reverse, so they have to accept all integer primary keys.
     """
     def get_absolute_url(self, url_name='detail'):
         """
@@ -23,34 +74,67 @@ class GetAbsoluteUrlMixin:
         a pk argument or a slug argument if its name is not `list` or
         `create`.
         """
+        key = (type(self), url_name, get_urlconf() or settings.ROOT_URLCONF, get_script_prefix(), get_language())
+        resolved_url = absolute_url_cache.get(key)
+        if resolved_url is None:
+            resolved_url = absolute_url_cache[key] = self.resolve_absolute_url(url_name)
+        argument, full_url_name, url_template = resolved_url
+        if argument is None:
+            return url_template
+        if argument == 'pk':
+            return get_pk_url(full_url_name, url_template, self.pk)
+        # TODO: Raise an specific error message if self.slug does not exist or
+        #       reverse does not find an url.
+        return reverse(full_url_name, kwargs={'slug': str(self.slug)})
+
+    def resolve_absolute_url(self, url_name):
+        """
+        Finds out whether the url concerning the given url name has no
+        argument, a pk argument or a slug argument. Returns a tuple like the
+        values of absolute_url_cache.
+        """
+        full_url_name = self.get_absolute_url_name(url_name)
         if url_name == 'list' or url_name == 'create':
-            return reverse(self.get_absolute_url_name(url_name))
+            return (None, full_url_name, reverse(full_url_name))
         try:
-            return reverse(self.get_absolute_url_name(url_name), kwargs={'pk': str(self.pk)})
+            reverse(full_url_name, kwargs={'pk': str(self.pk)})
         except NoReverseMatch:
-            pass
-        # TODO: Raise an specific error message if self.slug does not exist or
-        #       reverse does not find an url.
-        return reverse(self.get_absolute_url_name(url_name), kwargs={'slug': str(self.slug)})
+            reverse(full_url_name, kwargs={'slug': str(self.slug)})
+            return ('slug', full_url_name, None)
+        return ('pk', full_url_name, get_pk_url_template(full_url_name))
 
-    def get_absolute_url_name(self, url_name='detail'):
+    @classmethod
+    def get_absolute_url_name(cls, url_name='detail'):
         """
         Returns the full url name (including namespace patterns) of the
         given url name.
         """
-        project_app_name = type(self).__module__.split('.models')[0]
-        class_name = type(self).__name__
+        project_app_name = cls.__module__.split('.models')[0]
+        class_name = cls.__name__
         return '%s:%s:%s' % (project_app_name, class_name, url_name)
 
 
+class classproperty:
+    """
+    Decorator like property for methods which get the class instead of the
+    instance. The attribute can be read from the class and its instances.
+    """
+    def __init__(self, method):
+        self.method = method
+        self.__doc__ = method.__doc__
+
+    def __get__(self, instance, owner):
+        return self.method(owner)
+
+
 class AutoModelMixin(GetAbsoluteUrlMixin):
     """
     Mixin for models to add automaticly designed urls and views.
 
-    Add this mixin to your model and include YourModel().urls in the
+    Add this mixin to your model and include YourModel.urls in the
     urlpatterns of your application::
 
-      url(r'^example/', include(YourModel().urls))
+      url(r'^example/', include(YourModel.urls))
 
     The urls and classes for a list view (`/example/`), a create view
     (`/example/create/`), a detail view (`/example/<pk>/`), an update view
@@ -65,47 +149,117 @@ class AutoModelMixin(GetAbsoluteUrlMixin):
     application (including the name of the project)::
 
       url(r'^example_app/', include(yourproject.yourapp.urls), namespace='yourproject.yourapp')
+
+    The list view shows list_paginate_by objects per page using keyset
+    pagination on the ordering of the model, see KeysetListView. The list
+    view and the detail view answer conditional GET requests with 304 Not
+    Modified if no object of the model was changed, see
+    ModelConditionalViewMixin.
+
+    If export_formats is set, an export view (`/example/export.<format>`)
+    streams all objects in the given formats, see ExportView.
+
+    The urlpatterns and the view classes are built once per model class and
+    reused afterwards.
+    """
+    list_paginate_by = 50
     """
-    @property
-    def urls(self):
+    Number of objects per page of the list view.
+    """
+
+    export_formats = ()
+    """
+    Formats of the export view, e. g. ('csv', 'jsonl'). The export view is
+    not set up if this is empty.
+    """
+
+    @classproperty
+    def urls(cls):
         """
         Attribute of mixed models. Include this in the urlpatterns of
         your application::
 
-          url(r'^example/', include(YourModel().urls))
+          url(r'^example/', include(YourModel.urls))
         """
-        return (self.get_urlpatterns(), None, type(self).__name__)
+        if '_auto_urlpatterns' not in cls.__dict__:
+            cls._auto_urlpatterns = cls.get_urlpatterns()
+        return (cls._auto_urlpatterns, None, cls.__name__)
 
-    def get_urlpatterns(self):
+    @classmethod
+    def get_urlpatterns(cls):
         """
         Method to get the urlpatterns object. Override this method to
         customize the urls.
         """
-        return patterns(
+        urlpatterns = patterns(
             '',
-            url(r'^$', self.get_view_class('List').as_view(), name='list'),
-            url(r'^create/$', self.get_view_class('Create').as_view(), name='create'),
-            url(r'^(?P<pk>\d+)/$', self.get_view_class('Detail').as_view(), name='detail'),
-            url(r'^(?P<pk>\d+)/update/$', self.get_view_class('Update').as_view(), name='update'),
-            url(r'^(?P<pk>\d+)/delete/$', self.get_view_class('Delete').as_view(), name='delete'))
+            url(r'^$', cls.get_view('List'), name='list'),
+            url(r'^create/$', cls.get_view('Create'), name='create'),
+            url(r'^(?P<pk>\d+)/$', cls.get_view('Detail'), name='detail'),
+            url(r'^(?P<pk>\d+)/update/$', cls.get_view('Update'), name='update'),
+            url(r'^(?P<pk>\d+)/delete/$', cls.get_view('Delete'), name='delete'))
+        if cls.export_formats:
+            urlpatterns += patterns(
+                '',
+                url(r'^export\.(?P<format>%s)$' % '|'.join(cls.export_formats), cls.get_view('Export'), name='export'))
+        return urlpatterns
 
-    def get_view_class(self, view_name):
+    @classmethod
+    def get_view(cls, view_name):
+        """
+        Returns the view function of the given view name. The view class is
+        constructed and converted only once per model class.
+        """
+        if '_auto_views' not in cls.__dict__:
+            cls._auto_views = {}
+        view = cls._auto_views.get(view_name)
+        if view is None:
+            view = cls._auto_views[view_name] = cls.get_view_class(view_name).as_view()
+        return view
+
+    @classmethod
+    def get_view_class(cls, view_name):
         """
         Method to construct the view classes. Override this method to
         customize them.
         """
-        view_class_definitions = {'model': type(self)}
+        view_class_definitions = {'model': cls}
+        mixins = ()
         if view_name == 'List':
-            view_class = ListView
+            view_class = KeysetListView
+            view_class_definitions['paginate_by'] = cls.list_paginate_by
+            mixins = (ModelConditionalViewMixin,)
         elif view_name == 'Create':
             view_class = CreateView
         elif view_name == 'Detail':
             view_class = DetailView
+            mixins = (ModelConditionalViewMixin,)
         elif view_name == 'Update':
             view_class = UpdateView
         elif view_name == 'Delete':
             view_class = DeleteView
-            view_class_definitions['success_url_name'] = self.get_absolute_url_name('list')
+            view_class_definitions['success_url_name'] = cls.get_absolute_url_name('list')
+        elif view_name == 'Export':
+            view_class = ExportView
         else:
             raise ValueError('The view name "%s" is unknown.' % view_name)
-        return type(view_name, (view_class,), view_class_definitions)
+        return type(view_name, mixins + (view_class,), view_class_definitions)
+
+
+def auto_model_changed(sender, **kwargs):
+    """
+    Sets the time of the last change of the model if an object of a model
+    with AutoModelMixin is saved or deleted.
+    """
+    set_model_last_modified(sender)
+
+
+@receiver(class_prepared, dispatch_uid='auto_model_class_prepared')
+def connect_auto_model(sender, **kwargs):
+    """
+    Connects auto_model_changed() to the save and delete signals of every
+    model with AutoModelMixin. Saves of other models do not call it.
+    """
+    if issubclass(sender, AutoModelMixin):
+        post_save.connect(auto_model_changed, sender=sender, dispatch_uid='auto_model_post_save')
+        post_delete.connect(auto_model_changed, sender=sender, dispatch_uid='auto_model_post_delete')
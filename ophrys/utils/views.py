@@ -1,7 +1,21 @@
+import csv
+import datetime
+import hashlib
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
-from django.views.generic import ListView, CreateView, DetailView, UpdateView, MonthArchiveView, FormView
+from django.db.models import Q
+from django.http import Http404, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag, urlencode
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
+from django.views.generic import View, ListView, CreateView, DetailView, UpdateView, MonthArchiveView, FormView
 from django.views.generic import DeleteView as _DeleteView
 
+from .cache import get_model_last_modified, get_pages_version
+
 
 class DeleteView(_DeleteView):
     """
@@ -10,3 +24,240 @@ class DeleteView(_DeleteView):
     """
     def get_success_url(self):
         return reverse(self.success_url_name)
+
+
+class ConditionalViewMixin:
+    """
+    Mixin for views to answer conditional GET requests. The ETag is computed
+    before anything is loaded from the database. If the client sends it in
+    the header If-None-Match, the response is 304 Not Modified without
+    loading objects or rendering templates.
+
+    The ETag is built from the strings returned by get_etag_parts(). By
+    default these are the version of all pages, the language, the time zone
+    and the user. Add everything else the content depends on. There is no
+    Last-Modified header because the content depends on these parts too.
+    """
+    def get_etag_parts(self):
+        user = getattr(self.request, 'user', None)
+        return [get_pages_version(), get_language(), get_current_timezone_name(), str(getattr(user, 'pk', ''))]
+
+    def get_etag(self):
+        return hashlib.md5(':'.join(self.get_etag_parts()).encode('utf-8')).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        etag = self.get_etag()
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304) and not response.has_header('ETag'):
+            response['ETag'] = quote_etag(etag)
+        return response
+
+
+class ModelConditionalViewMixin(ConditionalViewMixin):
+    """
+    Mixin for views of a model to answer conditional GET requests. The ETag
+    changes whenever an object of the model is saved or deleted. This works
+    for models with AutoModelMixin.
+    """
+    def get_etag_parts(self):
+        return super().get_etag_parts() + [get_model_last_modified(self.model).isoformat()]
+
+
+class KeysetListView(ListView):
+    """
+    View to list objects page by page. Instead of a page number the query
+    parameter 'after' contains the sort values of the last object of the
+    previous page (keyset pagination), so deep pages are as fast as the
+    first page. The objects are sorted by the ordering of the model and the
+    primary key. The ordering may only contain fields of the model itself
+    which are never null.
+
+    The context contains the url of the next page as 'next_page_url' and
+    the url of the first page as 'first_page_url'.
+    """
+    paginate_by = 50
+    page_kwarg = 'after'
+    next_cursor = None
+
+    def get_ordering_fields(self):
+        """
+        Returns a list of (field, descending) tuples of the sort order.
+        """
+        options = self.model._meta
+        ordering_fields = []
+        for name in options.ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            ordering_fields.append((options.pk if name == 'pk' else options.get_field(name), descending))
+        if options.pk not in [field for field, descending in ordering_fields]:
+            ordering_fields.append((options.pk, False))
+        return ordering_fields
+
+    def get_keyset_filter(self, ordering_fields, cursor):
+        """
+        Returns a Q object for all objects after the position given by the
+        cursor. Raises Http404 if the cursor is invalid.
+        """
+        try:
+            raw_values = json.loads(cursor)
+            if not isinstance(raw_values, list) or len(raw_values) != len(ordering_fields):
+                raise ValueError
+            values = [field.to_python(value) for (field, descending), value in zip(ordering_fields, raw_values)]
+        except (ValueError, ValidationError):
+            raise Http404('Invalid page.')
+        keyset_filter = None
+        for index, (field, descending) in enumerate(ordering_fields):
+            lookups = dict((equal_field.name, value) for (equal_field, equal_descending), value in zip(ordering_fields[:index], values))
+            lookups['%s__%s' % (field.name, 'lt' if descending else 'gt')] = values[index]
+            keyset_filter = Q(**lookups) if keyset_filter is None else keyset_filter | Q(**lookups)
+        return keyset_filter
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Returns the objects of the requested page. Fetches one object more
+        to find out whether there is a next page.
+        """
+        ordering_fields = self.get_ordering_fields()
+        queryset = queryset.order_by(*[('-' if descending else '') + field.name for field, descending in ordering_fields])
+        cursor = self.request.GET.get(self.page_kwarg)
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_filter(ordering_fields, cursor))
+        object_list = list(queryset[:page_size + 1])
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            self.next_cursor = json.dumps([field.value_to_string(object_list[-1]) for field, descending in ordering_fields])
+        return (None, None, object_list, bool(cursor) or self.next_cursor is not None)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.next_cursor is not None:
+            context['next_page_url'] = '?' + urlencode({self.page_kwarg: self.next_cursor})
+        if self.request.GET.get(self.page_kwarg):
+            context['first_page_url'] = self.request.path
+        return context
+
+
+class LineBuffer:
+    """
+    File-like object for csv.writer which returns the written line instead
+    of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+class ExportView(View):
+    """
+    View to export all objects of a model as CSV file, as JSON Lines file or,
+    if the model has a class method iter_ical(objects), as iCalendar file.
+    The format is given by the url argument 'format'.
+
+    The objects are fetched in chunks of chunk_size objects ordered by the
+    primary key and the response is streamed, so the memory usage does not
+    depend on the number of objects.
+    """
+    model = None
+    chunk_size = 1000
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'jsonl': 'application/x-ndjson; charset=utf-8',
+        'ics': 'text/calendar; charset=utf-8'}
+
+    def get(self, request, *args, **kwargs):
+        export_format = kwargs['format']
+        if export_format == 'csv':
+            lines = self.iter_csv()
+        elif export_format == 'jsonl':
+            lines = self.iter_jsonl()
+        elif export_format == 'ics' and hasattr(self.model, 'iter_ical'):
+            lines = self.iter_ical()
+        else:
+            raise Http404('The format "%s" is not supported.' % export_format)
+        response = StreamingHttpResponse(self.iter_blocks(lines), content_type=self.content_types[export_format])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (self.model._meta.model_name, export_format)
+        return response
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def get_fields(self):
+        """
+        Returns the list of the exported fields. Override this method to
+        exclude fields.
+        """
+        return self.model._meta.concrete_fields
+
+    def iter_chunked(self, queryset, get_pk):
+        """
+        Generator for all items of the queryset ordered by primary key. Each
+        query fetches only chunk_size items. The function get_pk has to
+        return the primary key of an item.
+        """
+        last_pk = None
+        while True:
+            chunk = queryset.order_by('pk')
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            count = 0
+            for item in chunk[:self.chunk_size].iterator():
+                count += 1
+                last_pk = get_pk(item)
+                yield item
+            if count < self.chunk_size:
+                break
+
+    def iter_rows(self):
+        """
+        Generator for the values of the exported fields of all objects as
+        tuples.
+        """
+        fields = self.get_fields()
+        attnames = [field.attname for field in fields]
+        pk_index = attnames.index(self.model._meta.pk.attname)
+        return self.iter_chunked(self.get_queryset().values_list(*attnames), lambda row: row[pk_index])
+
+    def iter_ical(self):
+        """
+        Generator for the lines of the iCalendar file.
+        """
+        return self.model.iter_ical(self.iter_chunked(self.get_queryset(), lambda obj: obj.pk))
+
+    def iter_csv(self):
+        """
+        Generator for the lines of the CSV file. The first line contains the
+        names of the fields.
+        """
+        writer = csv.writer(LineBuffer())
+        yield writer.writerow([field.attname for field in self.get_fields()])
+        for row in self.iter_rows():
+            yield writer.writerow([
+                '' if value is None else value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else value
+                for value in row])
+
+    def iter_jsonl(self):
+        """
+        Generator for the lines of the JSON Lines file. Each line contains a
+        JSON object with the fields of one object.
+        """
+        attnames = [field.attname for field in self.get_fields()]
+        encoder = DjangoJSONEncoder()
+        for row in self.iter_rows():
+            yield encoder.encode(dict(zip(attnames, row))) + '\n'
+
+    def iter_blocks(self, lines):
+        """
+        Generator which joins the lines to blocks of chunk_size lines.
+        """
+        block = []
+        for line in lines:
+            block.append(line)
+            if len(block) >= self.chunk_size:
+                yield ''.join(block)
+                block = []
+        if block:
+            yield ''.join(block)
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from ophrys.accounts.middleware import TimeZoneMiddleware
+from ophrys.accounts.models import User
+
+
+class TimeZoneMiddlewareTest(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def test_user_time_zone(self):
+        self.request.user = User(email='Ohk9eeth1Ohy2jooZae4@example.com', time_zone='America/New_York')
+        TimeZoneMiddleware().process_request(self.request)
+        self.assertEqual(timezone.get_current_timezone_name(), 'America/New_York')
+
+    def test_default_time_zone(self):
+        timezone.activate('America/New_York')
+        self.request.user = AnonymousUser()
+        TimeZoneMiddleware().process_request(self.request)
+        self.assertEqual(timezone.get_current_timezone_name(), 'Europe/Berlin')
+
+    def test_unknown_time_zone(self):
+        timezone.activate('America/New_York')
+        self.request.user = User(email='eiGh6eifaeTh1ohvu5Ee@example.com', time_zone='Unknown/Eeyah6ie')
+        TimeZoneMiddleware().process_request(self.request)
+        self.assertEqual(timezone.get_current_timezone_name(), 'Europe/Berlin')
@@ -1,4 +1,13 @@
+import os
+import sys
+import tempfile
+from io import StringIO
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.test.client import Client
 
 from ophrys.accounts.models import User
 
@@ -22,3 +31,113 @@ class TestUser(TestCase):
 
     def test_create_superuser_without_email(self):
         self.assertRaisesMessage(ValueError, 'The given email must be set.', User.objects.create_superuser, email='', password='default')
+
+
+class BulkCreateUsersTest(TestCase):
+    def test_bulk_create_users(self):
+        users = User.objects.bulk_create_users([
+            {'email': 'Oeb3ahd8Ie@EXAMPLE.com', 'password': 'Aepee2ri'},
+            {'email': 'aiph0Eec6o@example.com', 'time_zone': 'America/New_York'}], processes=2, hasher='md5')
+        self.assertEqual([user.email for user in users], ['Oeb3ahd8Ie@example.com', 'aiph0Eec6o@example.com'])
+        user = User.objects.get(email='Oeb3ahd8Ie@example.com')
+        self.assertTrue(user.password.startswith('md5$'))
+        self.assertTrue(user.check_password('Aepee2ri'))
+        self.assertTrue(User.objects.get(pk=user.pk).password.startswith('pbkdf2_sha256$'))
+        user = User.objects.get(email='aiph0Eec6o@example.com')
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(user.time_zone, 'America/New_York')
+
+    def test_invalid_emails(self):
+        User.objects.create_user(email='Quie6ahs0u@example.com')
+        for emails, message in (
+                (['iel2Nah7ee@example.com', ''], 'The given email must be set.'),
+                (['Aeh4oozo8i'], 'The email "Aeh4oozo8i" is invalid.'),
+                (['Thu8shai3o@example.com', 'Thu8shai3o@EXAMPLE.COM'], 'The email "Thu8shai3o@example.com" is given twice.'),
+                (['Quie6ahs0u@example.com'], 'The email "Quie6ahs0u@example.com" is already used.')):
+            self.assertRaisesMessage(
+                ValueError, message, User.objects.bulk_create_users, [{'email': email} for email in emails], processes=1)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_invalid_fields(self):
+        for user, message in (
+                ({'email': 'Ahj3oht4ie@example.com', 'time_zone': 'Mars/Olympus_Mons'}, 'The time zone "Mars/Olympus_Mons" is invalid.'),
+                ({'email': 'Ahj3oht4ie@example.com', 'nickname': 'Ahj3'}, 'The field "nickname" is unknown.')):
+            self.assertRaisesMessage(ValueError, message, User.objects.bulk_create_users, [user], processes=1)
+        self.assertFalse(User.objects.exists())
+
+    def test_import_users_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('email,password,time_zone\nohV4eiph5a@example.com,Pai7ohgh,\nEe9quoh8ie@example.com,,Europe/London\n')
+        try:
+            call_command('import_users', csv_file.name, processes=1, batch_size=1, stdout=StringIO())
+            self.assertTrue(User.objects.get(email='ohV4eiph5a@example.com').check_password('Pai7ohgh'))
+            self.assertEqual(User.objects.get(email='Ee9quoh8ie@example.com').time_zone, 'Europe/London')
+            self.assertRaisesMessage(
+                CommandError, 'Error in the rows 1 to 1: The email "ohV4eiph5a@example.com" is already used.',
+                call_command, 'import_users', csv_file.name, processes=1, batch_size=1, stdout=StringIO())
+        finally:
+            os.remove(csv_file.name)
+
+    def test_import_users_command_with_invalid_time_zone(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('email,time_zone\nooNg9iequ4@example.com,Europe/London\nJae0ied6ai@example.com,Europe/Gotham\n')
+        try:
+            self.assertRaisesMessage(
+                CommandError, 'Error in the rows 2 to 2: The time zone "Europe/Gotham" is invalid.',
+                call_command, 'import_users', csv_file.name, processes=1, batch_size=1, stdout=StringIO())
+        finally:
+            os.remove(csv_file.name)
+        self.assertFalse(User.objects.exists())
+
+    def test_import_users_command_from_stdin(self):
+        stdin = sys.stdin
+        sys.stdin = StringIO('email,password\nAeZ3ahng0u@example.com,Oox6aiph\nbaiJ4ohqu2@example.com,\nOhgh1ieVae@example.com,\n')
+        try:
+            stdout = StringIO()
+            call_command('import_users', '-', processes=2, batch_size=2, hasher='md5', stdout=stdout)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(stdout.getvalue().strip(), '3 users successfully imported.')
+        self.assertTrue(User.objects.get(email='AeZ3ahng0u@example.com').check_password('Oox6aiph'))
+        self.assertTrue(User.objects.filter(email='Ohgh1ieVae@example.com').exists())
+
+    def test_import_users_command_without_file(self):
+        self.assertRaisesMessage(CommandError, 'Enter the path of the CSV file.', call_command, 'import_users', stdout=StringIO())
+
+
+class NormalizedEmailTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='Ieng4Ohvoh@Example.com', password='uNg8phee')
+
+    def test_get_by_natural_key(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(User.objects.get_by_natural_key('ieng4ohvoh@EXAMPLE.COM'), self.user)
+        self.assertRaises(User.DoesNotExist, User.objects.get_by_natural_key, 'Eiza4thoo0@example.com')
+
+    def test_login_ignoring_case(self):
+        self.assertTrue(Client().login(username='IENG4OHVOH@example.com', password='uNg8phee'))
+
+    def test_change_email(self):
+        self.user.email = 'Zo2ahngei1@example.com'
+        self.user.save(update_fields=['email'])
+        self.assertEqual(User.objects.get_by_natural_key('zo2ahngei1@example.com'), self.user)
+
+    def test_email_differing_in_case(self):
+        self.assertRaisesMessage(
+            ValueError, 'The email "Ieng4Ohvoh@example.com" is already used.',
+            User.objects.create_user, email='ieng4ohvoh@example.com')
+        self.assertRaisesMessage(
+            ValueError, 'The email "Ieng4Ohvoh@example.com" is already used.',
+            User.objects.bulk_create_users, [{'email': 'IENG4OHVOH@example.com'}], processes=1)
+        self.assertRaisesMessage(
+            ValueError, 'The email "Iexai3Ohgh@example.com" is given twice.',
+            User.objects.bulk_create_users, [{'email': 'iexai3ohgh@example.com'}, {'email': 'Iexai3Ohgh@example.com'}], processes=1)
+
+    def test_validate_unique_ignoring_case(self):
+        user = User(email='IENG4OHVOH@example.com')
+        with self.assertRaises(ValidationError) as context:
+            user.validate_unique()
+        self.assertEqual(context.exception.message_dict, {'email': ['The email "IENG4OHVOH@example.com" is already used.']})
+        user.validate_unique(exclude=['email'])
+        self.user.email = 'IENG4OHVOH@example.com'
+        self.user.validate_unique()
@@ -0,0 +1,26 @@
+import datetime
+
+from django.test import TestCase
+from django.utils.timezone import utc
+
+from ophrys.calendarevent.calendar_cache import ALL_MONTHS, get_event_months
+from ophrys.calendarevent.models import Event
+
+
+class GetEventMonthsTest(TestCase):
+    def test_months_around_new_year(self):
+        event = Event(title='aeR0eeke7ohs9ooVeeb4', begin=datetime.datetime(2013, 12, 31, 23, tzinfo=utc))
+        self.assertEqual(get_event_months(event), set([(2013, 12), (2014, 1)]))
+
+    def test_months_of_long_event(self):
+        event = Event(title='Ooquai2Ohreik4aiy4oo', begin=datetime.datetime(2013, 6, 15, tzinfo=utc), duration=60*24*60)
+        self.assertEqual(get_event_months(event), set([(2013, 6), (2013, 7), (2013, 8)]))
+
+    def test_months_of_recurring_event(self):
+        event = Event(title='Eisoo7ahkie4Teiquie8', begin=datetime.datetime(2013, 6, 15, tzinfo=utc), recurrence='weekly')
+        self.assertTrue(get_event_months(event) is ALL_MONTHS)
+
+    def test_save_event_with_new_pk(self):
+        event = Event(pk=42, title='ohBo5ahmaiR4ieChah3a', begin=datetime.datetime(2013, 6, 15, tzinfo=utc))
+        event.save()
+        self.assertTrue(Event.objects.filter(pk=42).exists())
@@ -0,0 +1,76 @@
+import datetime
+
+import pytz
+from django.test import TestCase
+from django.utils.timezone import now, utc
+
+from ophrys.calendarevent.ical import escape_text, fold_line, get_event_lines, get_time_zone_lines, iter_calendar
+from ophrys.calendarevent.models import Event
+
+
+class ICalTest(TestCase):
+    def test_escape_text(self):
+        self.assertEqual(escape_text('a\\b;c,d\r\ne'), 'a\\\\b\\;c\\,d\\ne')
+
+    def test_fold_line(self):
+        self.assertEqual(fold_line('SUMMARY:short'), 'SUMMARY:short\r\n')
+        folded = fold_line('DESCRIPTION:' + 'ä' * 40)
+        lines = folded.split('\r\n')
+        self.assertEqual(lines[-1], '')
+        self.assertTrue(all(len(line.encode('utf-8')) <= 75 for line in lines))
+        self.assertTrue(lines[1].startswith(' '))
+        self.assertEqual(''.join(line[1:] if index else line for index, line in enumerate(lines)), 'DESCRIPTION:' + 'ä' * 40)
+
+    def test_recurring_event(self):
+        event = Event(
+            pk=1, title='Weekly', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc),
+            recurrence='weekly', recurrence_interval=2, recurrence_until=datetime.datetime(2013, 9, 1, tzinfo=utc))
+        lines = get_event_lines(event, '20130701T000000Z')
+        self.assertIn('DTSTART;TZID=Europe/Berlin:20130702T120000\r\n', lines)
+        self.assertIn('RRULE:FREQ=WEEKLY;INTERVAL=2;UNTIL=20130901T000000Z\r\n', lines)
+        event = Event(pk=2, title='Daily', text='Every day', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc), recurrence='daily')
+        lines = get_event_lines(event, '20130701T000000Z')
+        self.assertIn('RRULE:FREQ=DAILY\r\n', lines)
+        self.assertIn('DESCRIPTION:Every day\r\n', lines)
+
+    def test_time_zone_lines(self):
+        lines = get_time_zone_lines(
+            pytz.timezone('Europe/Berlin'), datetime.datetime(2013, 7, 2, 10, tzinfo=utc), datetime.datetime(2014, 7, 2, tzinfo=utc))
+        self.assertEqual(lines, [line + '\r\n' for line in (
+            'BEGIN:VTIMEZONE', 'TZID:Europe/Berlin',
+            'BEGIN:DAYLIGHT', 'DTSTART:20130331T020000', 'TZOFFSETFROM:+0100', 'TZOFFSETTO:+0200', 'TZNAME:CEST', 'END:DAYLIGHT',
+            'BEGIN:STANDARD', 'DTSTART:20131027T030000', 'TZOFFSETFROM:+0200', 'TZOFFSETTO:+0100', 'TZNAME:CET', 'END:STANDARD',
+            'BEGIN:DAYLIGHT', 'DTSTART:20140330T020000', 'TZOFFSETFROM:+0100', 'TZOFFSETTO:+0200', 'TZNAME:CEST', 'END:DAYLIGHT',
+            'END:VTIMEZONE')])
+
+    def test_time_zone_lines_with_fixed_offset(self):
+        lines = get_time_zone_lines(
+            pytz.timezone('Etc/GMT+5'), datetime.datetime(2013, 7, 2, 10, tzinfo=utc), datetime.datetime(2014, 7, 2, tzinfo=utc))
+        self.assertEqual(lines, [line + '\r\n' for line in (
+            'BEGIN:VTIMEZONE', 'TZID:Etc/GMT+5',
+            'BEGIN:STANDARD', 'DTSTART:20130702T050000', 'TZOFFSETFROM:-0500', 'TZOFFSETTO:-0500', 'TZNAME:-05', 'END:STANDARD',
+            'END:VTIMEZONE')])
+
+    def test_calendar_with_time_zone(self):
+        events = [Event(pk=1, title='Once', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc))]
+        self.assertNotIn('BEGIN:VTIMEZONE\r\n', list(iter_calendar(events)))
+        events += [Event(pk=2, title='Weekly', begin=datetime.datetime(2013, 8, 2, 10, tzinfo=utc), recurrence='weekly',
+                         recurrence_until=datetime.datetime(2014, 1, 1, tzinfo=utc)),
+                   Event(pk=3, title='Daily', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc), recurrence='daily',
+                         recurrence_until=datetime.datetime(2013, 12, 1, tzinfo=utc)),
+                   Event(pk=4, title='Monthly', begin=datetime.datetime(2013, 9, 2, 10, tzinfo=utc), recurrence='monthly',
+                         recurrence_until=datetime.datetime(2014, 12, 1, tzinfo=utc))]
+        lines = list(iter_calendar(events))
+        self.assertEqual(lines.count('BEGIN:VTIMEZONE\r\n'), 1)
+        # The first change of the offset is the last one before the first
+        # recurring event.
+        self.assertEqual(lines[lines.index('BEGIN:VTIMEZONE\r\n') + 3], 'DTSTART:20130331T020000\r\n')
+        # The last change of the offset is the last one before the last
+        # possible begin of the recurring events.
+        self.assertEqual(lines[lines.index('END:VTIMEZONE\r\n') - 5], 'DTSTART:20141026T030000\r\n')
+        # Without an end the component covers the next years.
+        events.append(Event(pk=5, title='Yearly', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc), recurrence='yearly'))
+        lines = list(iter_calendar(events))
+        last_change = lines[lines.index('END:VTIMEZONE\r\n') - 5]
+        self.assertGreaterEqual(int(last_change[len('DTSTART:'):][:4]), now().year + 9)
+        self.assertEqual(lines[-1], 'END:VCALENDAR\r\n')
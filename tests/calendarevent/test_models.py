@@ -27,3 +27,54 @@ class TestEvent(TestCase):
                                        begin=datetime.datetime(2013, 7, 20, 13, 30, tzinfo=utc),
                                        duration=45)
         self.assertEqual(event_2.end, datetime.datetime(2013, 7, 20, 14, 15, tzinfo=utc))
+
+    def test_get_occurrences_of_recurring_event(self):
+        # 2013-03-21 19:00 in Europe/Berlin (CET)
+        event = Event.objects.create(title='Eiv3ohkaeX9ahhah8gah', begin=datetime.datetime(2013, 3, 21, 18, tzinfo=utc),
+                                     recurrence='weekly')
+        occurrences = list(event.get_occurrences(datetime.datetime(2013, 4, 1, tzinfo=utc), datetime.datetime(2013, 4, 8, tzinfo=utc)))
+        self.assertEqual(len(occurrences), 1)
+        # 2013-04-04 19:00 in Europe/Berlin (CEST)
+        self.assertEqual(occurrences[0].begin, datetime.datetime(2013, 4, 4, 17, tzinfo=utc))
+        self.assertEqual(occurrences[0].title, 'Eiv3ohkaeX9ahhah8gah')
+        self.assertEqual(str(occurrences[0]), 'Eiv3ohkaeX9ahhah8gah')
+        self.assertTrue(occurrences[0].end is None)
+
+    def test_get_occurrences(self):
+        start = datetime.datetime(2013, 7, 1, tzinfo=utc)
+        end = datetime.datetime(2013, 8, 1, tzinfo=utc)
+        Event.objects.create(title='Ahfoo2Shie9ohch3oowe', begin=datetime.datetime(2013, 6, 30, tzinfo=utc), duration=2*24*60)
+        Event.objects.create(title='Ohk5eeChaingaiZ4ohd5', begin=datetime.datetime(2013, 6, 1, tzinfo=utc))
+        Event.objects.create(title='Oob3eitah4', begin=datetime.datetime(2013, 6, 1, tzinfo=utc), duration=29*24*60)
+        Event.objects.create(title='ahngaeNgiu3ie7eeKaer', begin=datetime.datetime(2013, 1, 1, tzinfo=utc),
+                             recurrence='weekly', recurrence_until=datetime.datetime(2013, 3, 1, tzinfo=utc))
+        # 2013-01-03 11:00 in Europe/Berlin (CET)
+        event = Event.objects.create(title='ieZ7eiyahthaet5Dai8B', begin=datetime.datetime(2013, 1, 3, 10, tzinfo=utc),
+                                     recurrence='monthly', recurrence_interval=2)
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(str(event) for event in Event.objects.overlapping(start, end)),
+                             ['Ahfoo2Shie9ohch3oowe', 'ieZ7eiyahthaet5Dai8B'])
+        occurrences = Event.objects.get_occurrences(start, end)
+        self.assertEqual([(str(occurrence), occurrence.begin) for occurrence in occurrences],
+                         [('Ahfoo2Shie9ohch3oowe', datetime.datetime(2013, 6, 30, tzinfo=utc)),
+                          ('ieZ7eiyahthaet5Dai8B', datetime.datetime(2013, 7, 3, 9, tzinfo=utc))])
+        self.assertEqual(occurrences[0].end, datetime.datetime(2013, 7, 2, tzinfo=utc))
+        self.assertEqual(occurrences[1].get_absolute_url(), '/calendar/event/%d/' % event.pk)
+
+    def test_last_end(self):
+        self.assertEqual(self.event.last_end, self.event.begin)
+        event = Event.objects.create(title='Ooz5iequ1u', begin=datetime.datetime(2013, 6, 1, tzinfo=utc), duration=90,
+                                     recurrence='weekly', recurrence_until=datetime.datetime(2013, 7, 1, tzinfo=utc))
+        self.assertEqual(event.last_end, datetime.datetime(2013, 7, 1, 1, 30, tzinfo=utc))
+        event.recurrence_until = None
+        event.save(update_fields=['recurrence_until'])
+        self.assertIsNone(Event.objects.get(pk=event.pk).last_end)
+
+    def test_get_occurrences_outside_interval(self):
+        start = datetime.datetime(2013, 7, 1, tzinfo=utc)
+        end = datetime.datetime(2013, 8, 1, tzinfo=utc)
+        event = Event.objects.create(title='Ra5eiwoh0ahngie9Phei', begin=datetime.datetime(2013, 6, 1, tzinfo=utc), duration=60)
+        self.assertEqual(list(event.get_occurrences(start, end)), [])
+        event = Event.objects.create(title='eeGh2ahsh1Mu7aiwoo5u', begin=datetime.datetime(2013, 6, 1, tzinfo=utc),
+                                     recurrence='daily', recurrence_until=datetime.datetime(2013, 6, 5, tzinfo=utc))
+        self.assertEqual(list(event.get_occurrences(start, end)), [])
@@ -0,0 +1,48 @@
+import datetime
+from itertools import islice
+
+from django.test import TestCase
+
+from ophrys.calendarevent.recurrence import add_months, iter_recurrences
+
+
+class AddMonthsTest(TestCase):
+    def test_add_months(self):
+        self.assertEqual(add_months(datetime.datetime(2013, 11, 15, 10), 3), datetime.datetime(2014, 2, 15, 10))
+
+    def test_add_months_to_not_existing_day(self):
+        self.assertTrue(add_months(datetime.datetime(2013, 1, 31), 1) is None)
+
+
+class IterRecurrencesTest(TestCase):
+    def test_daily_until(self):
+        self.assertEqual(
+            list(iter_recurrences(datetime.datetime(2013, 1, 1, 10), 'daily', interval=2, until=datetime.datetime(2013, 1, 6))),
+            [datetime.datetime(2013, 1, 1, 10), datetime.datetime(2013, 1, 3, 10), datetime.datetime(2013, 1, 5, 10)])
+
+    def test_weekly_after(self):
+        recurrences = iter_recurrences(datetime.datetime(2013, 1, 1, 10), 'weekly', after=datetime.datetime(2013, 2, 1))
+        self.assertEqual(list(islice(recurrences, 2)), [datetime.datetime(2013, 2, 5, 10), datetime.datetime(2013, 2, 12, 10)])
+
+    def test_monthly_skips_not_existing_days(self):
+        recurrences = iter_recurrences(datetime.datetime(2013, 1, 31, 10), 'monthly')
+        self.assertEqual(list(islice(recurrences, 3)),
+                         [datetime.datetime(2013, 1, 31, 10), datetime.datetime(2013, 3, 31, 10), datetime.datetime(2013, 5, 31, 10)])
+        recurrences = iter_recurrences(datetime.datetime(2013, 1, 31, 10), 'monthly', after=datetime.datetime(2013, 6, 15))
+        self.assertEqual(next(recurrences), datetime.datetime(2013, 7, 31, 10))
+
+    def test_monthly_after(self):
+        recurrences = iter_recurrences(datetime.datetime(2013, 1, 15, 10), 'monthly', after=datetime.datetime(2013, 6, 20))
+        self.assertEqual(next(recurrences), datetime.datetime(2013, 7, 15, 10))
+
+    def test_yearly_until(self):
+        self.assertEqual(
+            list(iter_recurrences(datetime.datetime(2012, 2, 29), 'yearly', until=datetime.datetime(2020, 1, 1))),
+            [datetime.datetime(2012, 2, 29), datetime.datetime(2016, 2, 29)])
+
+    def test_unknown_frequency(self):
+        self.assertRaisesMessage(
+            ValueError,
+            'The frequency "hourly_Phai3chahJ6aiquee" is unknown.',
+            next,
+            iter_recurrences(datetime.datetime(2013, 1, 1), 'hourly_Phai3chahJ6aiquee'))
@@ -1,14 +1,20 @@
 import datetime
+import json
 
+import pytz
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.client import Client
-from django.utils.timezone import now, utc
+from django.utils.timezone import localtime, now, utc
 
-from ophrys.calendarevent.models import Event
+from ophrys.accounts.models import User
+from ophrys.calendarevent.models import Event, EventDeletion
+from ophrys.core.config import config
 
 
 class CalendarTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
 
     def test_calendar_view_default(self):
@@ -18,6 +24,13 @@ class CalendarTest(TestCase):
         self.assertContains(response, '<a href="/calendar/event/1/">ohP3thu9aiviepaeFeph</a>')
         self.assertNotContains(response, '<a href="/calendar/event/2/">Queiv1oojuLuip9Wo0qu</a>')
 
+    def test_calendar_view_default_in_time_zone_of_user(self):
+        User.objects.create_user(email='Ahth3aiy9ohmah6eiLie@example.com', password='Ceir5ahr', time_zone='Pacific/Kiritimati')
+        self.client.login(username='Ahth3aiy9ohmah6eiLie@example.com', password='Ceir5ahr')
+        response = self.client.get('/calendar/')
+        today = localtime(now(), pytz.timezone('Pacific/Kiritimati')).date()
+        self.assertEqual(response.context['month'], datetime.date(today.year, today.month, 1))
+
     def test_calendar_view_specific(self):
         event_1 = Event.objects.create(title='Oochai4aigohheiXohpe', begin=now())
         event_2 = Event.objects.create(title='ahba2Ahzee5Ochohth8u', begin=datetime.datetime(2013, 7, 20, tzinfo=utc))
@@ -25,6 +38,54 @@ class CalendarTest(TestCase):
         self.assertNotContains(response, '<a href="/calendar/event/1/">Oochai4aigohheiXohpe</a>')
         self.assertContains(response, '<a href="/calendar/event/2/">ahba2Ahzee5Ochohth8u</a>')
 
+    def test_calendar_view_several_events_on_one_day(self):
+        Event.objects.create(title='ieWoh3quaiph7Ooriebe', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        Event.objects.create(title='Oof4eim9ahHahhahwoh6', begin=datetime.datetime(2013, 7, 20, 12, tzinfo=utc))
+        response = self.client.get('/calendar/2013-7/')
+        self.assertContains(response, '20 <a href="/calendar/event/1/">ieWoh3quaiph7Ooriebe</a> '
+                                      '<a href="/calendar/event/2/">Oof4eim9ahHahhahwoh6</a>')
+        self.assertContains(response, '21 </td>')
+
+    def test_calendar_view_event_lasting_several_days(self):
+        Event.objects.create(title='ea8Eiphah6aeNg3ieSh9', begin=datetime.datetime(2013, 6, 28, 10, tzinfo=utc), duration=4*24*60)
+        response = self.client.get('/calendar/2013-7/')
+        self.assertContains(response, '1 <a href="/calendar/event/1/">ea8Eiphah6aeNg3ieSh9</a>')
+        self.assertContains(response, '2 <a href="/calendar/event/1/">ea8Eiphah6aeNg3ieSh9</a>')
+        self.assertContains(response, '3 </td>')
+
+    def test_calendar_view_recurring_event(self):
+        Event.objects.create(title='Ru4eiTh8aeN3uyaibeiy', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc), recurrence='weekly')
+        response = self.client.get('/calendar/2013-8/')
+        for day in (6, 13, 20, 27):
+            self.assertContains(response, '%d <a href="/calendar/event/1/">Ru4eiTh8aeN3uyaibeiy</a>' % day)
+        self.assertContains(response, '7 </td>')
+
+    def test_calendar_view_conditional(self):
+        etag = self.client.get('/calendar/2013-7/')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/calendar/2013-7/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Event.objects.create(title='Uoph4oongaeJohch9ahv', begin=datetime.datetime(2013, 8, 20, tzinfo=utc))
+        self.assertEqual(self.client.get('/calendar/2013-7/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Event.objects.create(title='aiShie2ahhohD5lahxoo', begin=datetime.datetime(2013, 7, 20, tzinfo=utc))
+        self.assertContains(self.client.get('/calendar/2013-7/', HTTP_IF_NONE_MATCH=etag), 'aiShie2ahhohD5lahxoo')
+
+    def test_calendar_view_queries(self):
+        self.client.get('/calendar/2013-7/')
+        Event.objects.create(title='thoo9eiZaeCh3ahxai6u', begin=datetime.datetime(2013, 7, 20, tzinfo=utc))
+        with self.assertNumQueries(1):  # Events of the month, no date list
+            response = self.client.get('/calendar/2013-7/')
+        self.assertContains(response, 'thoo9eiZaeCh3ahxai6u')
+
+    def test_calendar_view_invalid_month(self):
+        self.assertEqual(self.client.get('/calendar/2013-13/').status_code, 404)
+
+    def test_calendar_view_december(self):
+        Event.objects.create(title='Eeg4phiel7', begin=datetime.datetime(2013, 12, 31, 12, tzinfo=utc))
+        Event.objects.create(title='Ohgh7ohph5', begin=datetime.datetime(2014, 1, 1, 12, tzinfo=utc))
+        response = self.client.get('/calendar/2013-12/')
+        self.assertContains(response, 'Eeg4phiel7')
+        self.assertNotContains(response, 'Ohgh7ohph5')
+
     def test_calender_view_first_of_month(self):
         event = Event.objects.create(title='looCethie3eech0loayu', begin=datetime.datetime(2013, 11, 30, 23, 59, tzinfo=utc))
         # Default: TIME_ZONE='Europe/Berlin'
@@ -36,6 +97,44 @@ class CalendarTest(TestCase):
             self.assertContains(response, '30 <a href="/calendar/event/1/">looCethie3eech0loayu</a>')
 
 
+class CalendarCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_cache_hit(self):
+        Event.objects.create(title='Tha4aeCh0ahx8Ohgh8oo', begin=datetime.datetime(2013, 7, 20, tzinfo=utc))
+        self.client.get('/calendar/2013-7/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/calendar/2013-7/')
+        self.assertContains(response, '<a href="/calendar/event/1/">Tha4aeCh0ahx8Ohgh8oo</a>')
+        self.assertContains(response, '/calendar/2013-6/')
+        self.assertContains(response, '/calendar/2013-8/')
+
+    def test_invalidation_on_create_update_and_delete(self):
+        self.assertNotContains(self.client.get('/calendar/2013-7/'), 'Wai6aiShoh3eejohBeiy')
+        event = Event.objects.create(title='Wai6aiShoh3eejohBeiy', begin=datetime.datetime(2013, 7, 20, tzinfo=utc))
+        self.assertContains(self.client.get('/calendar/2013-7/'), 'Wai6aiShoh3eejohBeiy')
+        self.assertNotContains(self.client.get('/calendar/2013-9/'), 'Wai6aiShoh3eejohBeiy')
+        event.begin = datetime.datetime(2013, 9, 20, tzinfo=utc)
+        event.save()
+        self.assertNotContains(self.client.get('/calendar/2013-7/'), 'Wai6aiShoh3eejohBeiy')
+        self.assertContains(self.client.get('/calendar/2013-9/'), 'Wai6aiShoh3eejohBeiy')
+        event.delete()
+        self.assertNotContains(self.client.get('/calendar/2013-9/'), 'Wai6aiShoh3eejohBeiy')
+
+    def test_invalidation_of_other_months(self):
+        self.client.get('/calendar/2013-7/')
+        Event.objects.create(title='EiNg7uu0ahR8ahhoh2ie', begin=datetime.datetime(2013, 9, 20, tzinfo=utc))
+        with self.assertNumQueries(0):
+            self.client.get('/calendar/2013-7/')
+
+    def test_invalidation_by_recurring_event(self):
+        self.client.get('/calendar/2013-7/')
+        Event.objects.create(title='phuoPh8iezaeThahqu0i', begin=datetime.datetime(2013, 1, 1, tzinfo=utc), recurrence='monthly')
+        self.assertContains(self.client.get('/calendar/2013-7/'), 'phuoPh8iezaeThahqu0i')
+
+
 class EventTest(TestCase):
     def setUP(self):
         self.client = Client()
@@ -49,6 +148,58 @@ class EventTest(TestCase):
         self.assertRedirects(response, '/calendar/event/1/')
         self.assertTrue(Event.objects.filter(title='ieDie0oow9cho1raem9o').exists())
 
+    def test_list_view(self):
+        begin = datetime.datetime(2013, 7, 20, tzinfo=utc)
+        Event.objects.bulk_create([
+            Event(title='Event_%d' % number, begin=begin + datetime.timedelta(hours=(60 - number) // 2)) for number in range(61)])
+        response = self.client.get('/calendar/event/')
+        titles = [event.title for event in response.context['event_list']]
+        self.assertEqual(titles[:3], ['Event_59', 'Event_60', 'Event_57'])
+        self.assertEqual(len(titles), 50)
+        self.assertNotIn('first_page_url', response.context)
+        response = self.client.get('/calendar/event/' + response.context['next_page_url'])
+        titles += [event.title for event in response.context['event_list']]
+        self.assertEqual(titles[50:], ['Event_9', 'Event_10', 'Event_7', 'Event_8', 'Event_5', 'Event_6',
+                                       'Event_3', 'Event_4', 'Event_1', 'Event_2', 'Event_0'])
+        self.assertEqual(len(set(titles)), 61)
+        self.assertEqual(response.context['first_page_url'], '/calendar/event/')
+        self.assertNotIn('next_page_url', response.context)
+        self.assertContains(response, '<a href="/calendar/event/1/">Event_0</a>')
+
+    def test_list_view_invalid_page(self):
+        self.assertEqual(self.client.get('/calendar/event/', {'after': 'eiC4ohxee6Aey4phoh0a'}).status_code, 404)
+        self.assertEqual(self.client.get('/calendar/event/', {'after': '["1"]'}).status_code, 404)
+        self.assertEqual(self.client.get('/calendar/event/', {'after': '["Eew2ahm", "1"]'}).status_code, 404)
+
+    def test_export_view(self):
+        event = Event.objects.create(title='Ahch8eequ, ohJee7ae', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc), duration=90)
+        response = self.client.get('/calendar/event/export.csv')
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines()[1:], [
+            '1,"Ahch8eequ, ohJee7ae",,2013-07-20T10:00:00+00:00,90,,,,2013-07-20T11:30:00+00:00,%s' % (
+                Event.objects.get(pk=event.pk).last_modified.isoformat())])
+        response = self.client.get('/calendar/event/export.ics')
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('DTSTART:20130720T100000Z\r\nDURATION:PT90M\r\nSUMMARY:Ahch8eequ\\, ohJee7ae\r\n', content)
+        self.assertEqual(self.client.get('/calendar/event/export.xml').status_code, 404)
+
+    def test_conditional_list_and_detail_view(self):
+        cache.clear()
+        event = Event.objects.create(title='Ohsh4ohzeeQuoh6iefae', begin=now())
+        for url in ('/calendar/event/', '/calendar/event/1/'):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        etag = self.client.get('/calendar/event/1/')['ETag']
+        event.title = 'Feey9aeghaeboo4ieSho'
+        event.save()
+        self.assertContains(self.client.get('/calendar/event/1/', HTTP_IF_NONE_MATCH=etag), 'Feey9aeghaeboo4ieSho')
+        etag = self.client.get('/calendar/event/1/')['ETag']
+        config.organisation_name = 'ohG8ooy4ohng7ohNg1ie'
+        self.assertContains(self.client.get('/calendar/event/1/', HTTP_IF_NONE_MATCH=etag), 'ohG8ooy4ohng7ohNg1ie')
+
     def test_detail_view(self):
         Event.objects.create(title='ohngie5eem1YeeThieve', begin=now())
         response = self.client.get('/calendar/event/1/')
@@ -72,3 +223,112 @@ class EventTest(TestCase):
         response = self.client.post('/calendar/event/1/delete/')
         self.assertRedirects(response, '/calendar/event/')
         self.assertFalse(Event.objects.filter(title='ohW9eidie7Uatoot9eem').exists())
+
+
+class EventFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_feed(self):
+        Event.objects.create(title='Zeiph1Eiphaiy4ahdeeb', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc), duration=60)
+        Event.objects.create(title='oow7Chohz4ohpeeTh5xa', begin=datetime.datetime(2013, 7, 2, 10, tzinfo=utc), recurrence='weekly')
+        Event.objects.create(title='Iengeesh3chae0Ohv4Ae', begin=datetime.datetime(2013, 8, 20, 10, tzinfo=utc))
+        with self.assertNumQueries(1):
+            response = self.client.get('/calendar/feed/', {'start': '2013-07-15', 'end': '2013-07-24T00:00:00+02:00'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content.decode()), [
+            {'id': 2, 'title': 'oow7Chohz4ohpeeTh5xa', 'begin': '2013-07-16T10:00:00+00:00', 'end': None, 'url': '/calendar/event/2/'},
+            {'id': 1, 'title': 'Zeiph1Eiphaiy4ahdeeb', 'begin': '2013-07-20T10:00:00+00:00', 'end': '2013-07-20T11:00:00+00:00',
+             'url': '/calendar/event/1/'},
+            {'id': 2, 'title': 'oow7Chohz4ohpeeTh5xa', 'begin': '2013-07-23T10:00:00+00:00', 'end': None, 'url': '/calendar/event/2/'}])
+
+    def test_conditional_get(self):
+        parameters = {'start': '2013-07-01', 'end': '2013-08-01'}
+        response = self.client.get('/calendar/feed/', parameters)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get('/calendar/feed/', parameters, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Event.objects.create(title='aeX2ohquieNg7iechuph', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        response = self.client.get('/calendar/feed/', parameters, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'aeX2ohquieNg7iechuph')
+
+    def test_invalid_parameters(self):
+        for parameters in ({}, {'start': '2013-07-01'}, {'start': 'Ahdoh5ie', 'end': '2013-08-01'},
+                           {'start': '2013-08-01', 'end': '2013-07-01'}, {'start': '2013-02-30', 'end': '2013-07-01'},
+                           {'start': '2013-07-01', 'end': '2015-07-01'}):
+            self.assertEqual(self.client.get('/calendar/feed/', parameters).status_code, 400)
+
+
+class EventICalFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def get_content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_full_feed(self):
+        Event.objects.create(title='Quo4shoo9ohyiePhe5ee', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        response = self.client.get('/calendar/feed.ics')
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        content = self.get_content(response)
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn('UID:ophrys-event-1\r\n', content)
+        self.assertIn('SUMMARY:Quo4shoo9ohyiePhe5ee\r\n', content)
+        self.assertTrue(response.has_header('X-Sync-Token'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/calendar/feed.ics', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_incremental_feed(self):
+        old_event = Event.objects.create(title='eeb6Cie3ooSh8eiquaiL', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        deleted_event = Event.objects.create(title='Ohkeeng0Ahngaesh8Yee', begin=datetime.datetime(2013, 7, 21, 10, tzinfo=utc))
+        Event.objects.filter(pk__in=[old_event.pk, deleted_event.pk]).update(last_modified=datetime.datetime(2013, 7, 1, tzinfo=utc))
+        deleted_event.delete()
+        Event.objects.create(title='Ahd2ich7eiceeB4Noo9u', begin=datetime.datetime(2013, 7, 22, 10, tzinfo=utc))
+        since = (now() - datetime.timedelta(minutes=1)).strftime('%Y%m%dT%H%M%SZ')
+        response = self.client.get('/calendar/feed.ics', {'since': since})
+        self.assertFalse(response.has_header('X-Sync-Full'))
+        content = self.get_content(response)
+        self.assertNotIn('eeb6Cie3ooSh8eiquaiL', content)
+        self.assertIn('SUMMARY:Ahd2ich7eiceeB4Noo9u\r\n', content)
+        self.assertIn('UID:ophrys-event-2\r\n', content)
+        self.assertIn('DTSTART:20130721T100000Z\r\nSTATUS:CANCELLED\r\n', content)
+        content = self.get_content(self.client.get('/calendar/feed.ics'))
+        self.assertIn('eeb6Cie3ooSh8eiquaiL', content)
+        self.assertNotIn('CANCELLED', content)
+
+    def test_since_in_iso_format(self):
+        Event.objects.create(title='Gai8quee1aiNgee1ieph', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        since = localtime(now() - datetime.timedelta(minutes=1))
+        for value in (since.isoformat(), since.strftime('%Y-%m-%dT%H:%M:%S')):
+            response = self.client.get('/calendar/feed.ics', {'since': value})
+            self.assertFalse(response.has_header('X-Sync-Full'))
+            self.assertIn('Gai8quee1aiNgee1ieph', self.get_content(response))
+        response = self.client.get('/calendar/feed.ics', {'since': (now() + datetime.timedelta(minutes=1)).isoformat()})
+        self.assertNotIn('Gai8quee1aiNgee1ieph', self.get_content(response))
+
+    def test_expired_since(self):
+        event = Event.objects.create(title='ahph3Ahw3ieCh8ohChoh', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        Event.objects.filter(pk=event.pk).update(last_modified=datetime.datetime(2013, 7, 1, tzinfo=utc))
+        response = self.client.get('/calendar/feed.ics', {'since': '20130702T000000Z'})
+        self.assertEqual(response['X-Sync-Full'], 'true')
+        self.assertIn('ahph3Ahw3ieCh8ohChoh', self.get_content(response))
+
+    def test_old_deleted_events_are_removed(self):
+        old_event = Event.objects.create(title='Ohd0eiweeFei5Ahlaeng', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        old_event_id = old_event.pk
+        old_event.delete()
+        self.assertEqual(str(EventDeletion.objects.get()), 'Deleted event %d' % old_event_id)
+        EventDeletion.objects.update(deleted=now() - EventDeletion.max_age - datetime.timedelta(days=1))
+        event = Event.objects.create(title='Eiph4ahjee8Ohngaechu', begin=datetime.datetime(2013, 7, 20, 10, tzinfo=utc))
+        event_id = event.pk
+        event.delete()
+        self.assertEqual([str(event_deletion) for event_deletion in EventDeletion.objects.all()], ['Deleted event %d' % event_id])
+
+    def test_invalid_since(self):
+        self.assertEqual(self.client.get('/calendar/feed.ics', {'since': 'Ooch5thi'}).status_code, 400)
+        self.assertEqual(self.client.get('/calendar/feed.ics', {'since': '2013-13-45T10:00:00'}).status_code, 400)
@@ -1,12 +1,23 @@
+import gc
+
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db.models.signals import post_init
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 
-from ophrys.core.config import config, ConfigVariable
+from ophrys.core.config import (CONFIG_CACHE_VERSION_KEY, config, config_registry, ConfigGroup,
+                                ConfigVariable, context_processor, get_default_value, get_lookup_count,
+                                invalidate_config_cache)
 from ophrys.core.models import ConfigStore
 from ophrys.core.signals import get_config_groups
+from ophrys.core.views import ConfigView
 
 
 class ConfigTest(TestCase):
+    def setUp(self):
+        invalidate_config_cache()
+
     def test_get_config_var_default_value(self):
         self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
 
@@ -15,6 +26,54 @@ class ConfigTest(TestCase):
         with self.assertNumQueries(1):
             self.assertEqual(config.config_var_johTho7uovikie6to8so, 'sahGaomoozoesheeQu2e')
 
+    def test_get_config_var_from_cache(self):
+        ConfigStore.objects.create(key='config_var_Ahph3ohthaiy6iethoo1', value='eeLoo2shiequ3Oofeexa')
+        self.assertEqual(config.config_var_Ahph3ohthaiy6iethoo1, 'eeLoo2shiequ3Oofeexa')
+        with self.assertNumQueries(0):
+            self.assertEqual(config.config_var_Ahph3ohthaiy6iethoo1, 'eeLoo2shiequ3Oofeexa')
+            self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+
+    def test_invalidate_cache_after_change_in_database(self):
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        config_store = ConfigStore.objects.create(key='config_var_eexooc5goh0eiCheeth0', value='ohgh1Eeph9ohGhoo8ahv')
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'ohgh1Eeph9ohGhoo8ahv')
+        config_store.delete()
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+
+    def test_reload_cache_after_change_by_other_process(self):
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        # Bulk creation does not send the post_save signal.
+        ConfigStore.objects.bulk_create([ConfigStore(key='config_var_eexooc5goh0eiCheeth0', value='aiph0Ooquoh2eemaiFoh')])
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        # Simulate the invalidation by another worker. The version is read
+        # again in the next request.
+        cache.delete(CONFIG_CACHE_VERSION_KEY)
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        request_started.send(sender=self.__class__)
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'aiph0Ooquoh2eemaiFoh')
+
+    def test_version_read_once_per_request(self):
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        cache.delete(CONFIG_CACHE_VERSION_KEY)
+        with self.assertNumQueries(0):
+            self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        self.assertIsNone(cache.get(CONFIG_CACHE_VERSION_KEY))
+        request_started.send(sender=self.__class__)
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
+        self.assertIsNotNone(cache.get(CONFIG_CACHE_VERSION_KEY))
+
+    def test_get_many(self):
+        ConfigStore.objects.create(key='config_var_ooy4Ra2daezaequ4phai', value=43)
+        with self.assertNumQueries(1):
+            values = config.get_many(['config_var_eexooc5goh0eiCheeth0', 'config_var_ooy4Ra2daezaequ4phai'])
+        self.assertEqual(values, {'config_var_eexooc5goh0eiCheeth0': 'faithoh2ooTh5eighooT',
+                                  'config_var_ooy4Ra2daezaequ4phai': 43})
+        self.assertRaisesMessage(
+            AttributeError,
+            'Config variable not_existing_variable_geitheyieYeisheJai5k does not exist',
+            config.get_many,
+            ['config_var_eexooc5goh0eiCheeth0', 'not_existing_variable_geitheyieYeisheJai5k'])
+
     def test_get_not_existing_config_var(self):
         def get_var(key):
             return getattr(config, key)
@@ -26,21 +85,81 @@ class ConfigTest(TestCase):
 
     def test_set_config_var_with_get_default_before(self):
         self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'faithoh2ooTh5eighooT')
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):  # Savepoint, insert and release
             config.config_var_eexooc5goh0eiCheeth0 = 'AiwusheFoo1moht7weng'
         self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'AiwusheFoo1moht7weng')
 
     def test_set_config_var_without_get_default_before(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):  # Savepoint, insert and release
             config.config_var_faithoh2ooTh5eighooT = 'azoo4Tu7ea4Nan7eiphe'
         self.assertEqual(config.config_var_faithoh2ooTh5eighooT, 'azoo4Tu7ea4Nan7eiphe')
 
     def test_set_config_var_which_exists_in_database_before(self):
         ConfigStore.objects.create(key='config_var_er1chaWapheoTe1iecei', value='aB9ahphuthiekohqu7ub')
-        with self.assertNumQueries(1):
+        with self.assertNumQueries(4):  # Savepoint, failing insert, rollback and update
             config.config_var_er1chaWapheoTe1iecei = 'gahmahniethohgh0AiRo'
+        self.assertEqual(ConfigStore.objects.filter(key='config_var_er1chaWapheoTe1iecei').count(), 1)
         self.assertEqual(config.config_var_er1chaWapheoTe1iecei, 'gahmahniethohgh0AiRo')
 
+    def test_update_many(self):
+        config_store = ConfigStore.objects.create(key='config_var_ooy4Ra2daezaequ4phai', value=43)
+        ConfigStore.objects.create(key='config_var_no3rohchitie6Caebaew', value=False)
+        self.assertEqual(config.config_var_ooy4Ra2daezaequ4phai, 43)
+        with self.assertNumQueries(5):  # Savepoint, select, update, insert and release
+            config.update_many({'config_var_eexooc5goh0eiCheeth0': 'Ohb7ahm6iegheiTh2pha',
+                                'config_var_ooy4Ra2daezaequ4phai': 44,
+                                'config_var_no3rohchitie6Caebaew': False,
+                                'config_var_Aec3eeKohhie3eis5ahn': 'new'})
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'Ohb7ahm6iegheiTh2pha')
+        self.assertEqual(config.config_var_ooy4Ra2daezaequ4phai, 44)
+        self.assertFalse(config.config_var_no3rohchitie6Caebaew)
+        self.assertEqual(config.config_var_Aec3eeKohhie3eis5ahn, 'new')
+        self.assertEqual(ConfigStore.objects.count(), 4)
+        self.assertEqual(ConfigStore.objects.get(key='config_var_ooy4Ra2daezaequ4phai').pk, config_store.pk)
+
+    def test_update_many_with_several_stored_variables(self):
+        config_stores = [
+            ConfigStore.objects.create(key='config_var_Ahd3ieth5aiGh2eexooj', value='Dee0ooW2ie'),
+            ConfigStore.objects.create(key='config_var_Yae8ooqu6eishae2Chai', value=[1, 2]),
+            ConfigStore.objects.create(key='config_var_oa9eiRoh1ahgh3Eich7u', value=False)]
+        with self.assertNumQueries(4):  # Savepoint, select, update and release
+            config.update_many({'config_var_Ahd3ieth5aiGh2eexooj': "Quo'te",
+                                'config_var_Yae8ooqu6eishae2Chai': {'a': [3]},
+                                'config_var_oa9eiRoh1ahgh3Eich7u': True})
+        self.assertEqual(
+            dict((config_store.key, (config_store.pk, config_store.value)) for config_store in ConfigStore.objects.all()),
+            {'config_var_Ahd3ieth5aiGh2eexooj': (config_stores[0].pk, "Quo'te"),
+             'config_var_Yae8ooqu6eishae2Chai': (config_stores[1].pk, {'a': [3]}),
+             'config_var_oa9eiRoh1ahgh3Eich7u': (config_stores[2].pk, True)})
+
+    def test_update_many_skips_default_values(self):
+        with self.assertNumQueries(3):
+            config.update_many({'config_var_eexooc5goh0eiCheeth0': 'faithoh2ooTh5eighooT',
+                                'config_var_ooy4Ra2daezaequ4phai': 42})
+        self.assertFalse(ConfigStore.objects.exists())
+
+    def test_update_many_with_concurrent_write(self):
+        ConfigStore.objects.create(key='config_var_ooy4Ra2daezaequ4phai', value=43)
+
+        def create_concurrently(sender, instance, **kwargs):
+            # Simulates another process which stores the variable after the
+            # select of update_many().
+            if instance.pk is None and instance.value == 'Iu6ohNg1ao8bohph1aiW':
+                post_init.disconnect(sender=ConfigStore, dispatch_uid='create_concurrently')
+                ConfigStore.objects.bulk_create([ConfigStore(key='config_var_eexooc5goh0eiCheeth0', value='ahM5oophaiBe6eemie0i')])
+
+        post_init.connect(create_concurrently, sender=ConfigStore, dispatch_uid='create_concurrently')
+        try:
+            config.update_many({'config_var_eexooc5goh0eiCheeth0': 'Iu6ohNg1ao8bohph1aiW',
+                                'config_var_ooy4Ra2daezaequ4phai': 44,
+                                'config_var_no3rohchitie6Caebaew': True})
+        finally:
+            post_init.disconnect(sender=ConfigStore, dispatch_uid='create_concurrently')
+        self.assertEqual(config.config_var_eexooc5goh0eiCheeth0, 'Iu6ohNg1ao8bohph1aiW')
+        self.assertEqual(config.config_var_ooy4Ra2daezaequ4phai, 44)
+        # The default value of the third variable is not stored.
+        self.assertEqual(ConfigStore.objects.count(), 2)
+
     def get_config_group_test_one(self):
         """
         Helper function for some tests.
@@ -61,8 +180,47 @@ class ConfigTest(TestCase):
         self.assertFalse(ConfigVariable(key='some_key_vaagoopaego7eik3au1T', value=45213574512) in config_group)
 
 
+class ConfigRegistryTest(TestCase):
+    def test_groups(self):
+        titles = [config_group.title for config_group in config_registry.groups]
+        self.assertTrue('Title for config_group_test_one_veey2mohfoogooh7Wio4' in titles)
+
+    def test_receivers_are_called_only_once(self):
+        calls = []
+
+        def config_group_counting(sender, **kwargs):
+            calls.append(sender)
+            return ConfigGroup(variables=(ConfigVariable(key='config_var_Ohh3ahshe8Eezoh3ohqu', value=7),))
+
+        get_config_groups.connect(config_group_counting, dispatch_uid='config_group_counting')
+        self.assertEqual(get_default_value('config_var_Ohh3ahshe8Eezoh3ohqu'), 7)
+        self.assertEqual(get_default_value('config_var_Ohh3ahshe8Eezoh3ohqu'), 7)
+        self.assertEqual(get_default_value('config_var_eexooc5goh0eiCheeth0'), 'faithoh2ooTh5eighooT')
+        self.assertEqual(len(calls), 1)
+        get_config_groups.disconnect(dispatch_uid='config_group_counting')
+        self.assertRaisesMessage(
+            TypeError,
+            'Config variable config_var_Ohh3ahshe8Eezoh3ohqu does not exist',
+            get_default_value,
+            'config_var_Ohh3ahshe8Eezoh3ohqu')
+
+    def test_garbage_collected_receiver(self):
+        def config_group_collected(sender, **kwargs):
+            return ConfigGroup(variables=(ConfigVariable(key='config_var_ieM3Oe8ooVoh4uuch1ee', value=8),))
+
+        get_config_groups.connect(config_group_collected)
+        self.assertEqual(get_default_value('config_var_ieM3Oe8ooVoh4uuch1ee'), 8)
+        receivers_version = get_config_groups.receivers_version
+        # The signal holds only a weak reference to the receiver.
+        del config_group_collected
+        gc.collect()
+        self.assertGreater(get_config_groups.receivers_version, receivers_version)
+        self.assertRaises(TypeError, get_default_value, 'config_var_ieM3Oe8ooVoh4uuch1ee')
+
+
 class ConfigViewTest(TestCase):
     def setUp(self):
+        invalidate_config_cache()
         self.client = Client()
 
     def test_get(self):
@@ -73,13 +231,19 @@ class ConfigViewTest(TestCase):
         self.assertContains(response, 'Label for config_var_eexooc5goh0eiCheeth0')
         self.assertContains(response, 'Title for config_group_test_one_veey2mohfoogooh7Wio4')
 
+    def test_get_initial_with_one_query(self):
+        ConfigStore.objects.create(key='config_var_ooy4Ra2daezaequ4phai', value=43)
+        with self.assertNumQueries(1):
+            initial = ConfigView().get_initial()
+        self.assertEqual(initial['config_var_ooy4Ra2daezaequ4phai'], 43)
+        self.assertEqual(initial['config_var_eexooc5goh0eiCheeth0'], 'faithoh2ooTh5eighooT')
+
     def test_post(self):
         post_data = self.client.get('/config/').context['form'].initial
-        num_queries = len(post_data)*3
         post_data['config_var_eexooc5goh0eiCheeth0'] = 'OoSoxoh2Ees1Quiz9roh'
         post_data['config_var_ooy4Ra2daezaequ4phai'] = 122
         post_data.pop('config_var_no3rohchitie6Caebaew')
-        with self.assertNumQueries(num_queries):  # 3 queries per variable
+        with self.assertNumQueries(4):  # Savepoint, select, bulk insert and release
             response = self.client.post('/config/', post_data)
             self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, '/config/')
@@ -89,6 +253,9 @@ class ConfigViewTest(TestCase):
 
 
 class ConfigVariablesTest(TestCase):
+    def setUp(self):
+        invalidate_config_cache()
+
     def test_organisation_name(self):
         self.assertEqual(config.organisation_name, 'Name of your Organisation')
 
@@ -96,3 +263,17 @@ class ConfigVariablesTest(TestCase):
         config.organisation_name = 'ahr7ais0beuph6Iev2Wo'
         response = Client().get('/')
         self.assertContains(response, '<title>ahr7ais0beuph6Iev2Wo</title>')
+
+    def test_context_processor(self):
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(0):
+            config_proxy = context_processor(request)['config']
+        self.assertTrue(context_processor(request)['config'] is config_proxy)
+        with self.assertNumQueries(1):
+            self.assertEqual(config_proxy.organisation_name, 'Name of your Organisation')
+            self.assertEqual(config_proxy.organisation_name, 'Name of your Organisation')
+        self.assertEqual(get_lookup_count(config_proxy), 2)
+        self.assertEqual(get_lookup_count(request.config_proxy), 2)
+        self.assertRaises(AttributeError, getattr, config_proxy, 'not_existing_variable_geitheyieYeisheJai5k')
+        self.assertRaises(AttributeError, getattr, config_proxy, '__deepcopy__')
+        self.assertEqual(get_lookup_count(config_proxy), 3)
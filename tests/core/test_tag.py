@@ -1,6 +1,17 @@
+import json
+from io import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models.signals import post_init
 from django.test import TestCase
+from django.test.client import Client
+from django.utils.timezone import now
 
-from ophrys.core.models import Tag, TagConnection
+from ophrys.calendarevent.models import Event
+from ophrys.core.models import add_tag_usages, bulk_tag, Tag, TagConnection, TagUsage
+from ophrys.core.tags import get_tag_cloud, get_tag_suggestions, tag_index
 
 from tests.models import TestModelD
 
@@ -10,6 +21,9 @@ class TaggedModelTest(TestCase):
         self.tag_1 = Tag.objects.create(name='yegahhahraing9Udoh7c')
         self.tag_2 = Tag.objects.create(name='iei6rair0Beeviu4ieG2')
         self.object_1 = TestModelD.objects.create(name='vethah2ozah3Ael7quue')
+        # Fill the cache of the content types so that the numbers of queries
+        # do not depend on the order of the tests.
+        ContentType.objects.get_for_model(TestModelD)
 
     def test_tag_str(self):
         self.assertEqual(str(self.tag_1), 'yegahhahraing9Udoh7c')
@@ -20,20 +34,35 @@ class TaggedModelTest(TestCase):
         with self.assertNumQueries(1):
             self.assertEqual(list(self.object_1.get_tags()), [self.tag_2, self.tag_1])
 
+    def test_with_tags(self):
+        object_2 = TestModelD.objects.create(name='aeWahxoh5sheiN4eequi')
+        TagConnection.objects.create(tag=self.tag_1, content_object=self.object_1)
+        TagConnection.objects.create(tag=self.tag_2, content_object=self.object_1)
+        TagConnection.objects.create(tag=self.tag_1, content_object=object_2)
+        with self.assertNumQueries(3):
+            tags = dict((tagged_object.name, list(tagged_object.get_tags()))
+                        for tagged_object in TestModelD.objects.with_tags())
+        self.assertEqual(tags, {'vethah2ozah3Ael7quue': [self.tag_2, self.tag_1], 'aeWahxoh5sheiN4eequi': [self.tag_1]})
+        with self.assertNumQueries(3):
+            tagged_object = TestModelD.objects.filter(name='aeWahxoh5sheiN4eequi').with_tags()[0]
+            self.assertEqual(list(tagged_object.get_tags()), [self.tag_1])
+
     def test_add_tag_via_object(self):
-        with self.assertNumQueries(1):
+        with self.assertNumQueries(8):  # Savepoint and release, select and insert of the connection, four queries for the counter
             self.object_1.add_tag(self.tag_1)
         with self.assertNumQueries(1):
             self.assertEqual(list(self.object_1.get_tags()), [self.tag_1])
+        self.object_1.add_tag(self.tag_1)
+        self.assertEqual(TagConnection.objects.count(), 1)
 
     def test_add_tag_via_string(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(9):  # Tag, savepoint, release, select and insert of the connection, four queries for the counter
             self.object_1.add_tag('yegahhahraing9Udoh7c')
         with self.assertNumQueries(1):
             self.assertEqual(list(self.object_1.get_tags()), [self.tag_1])
 
     def test_add_new_tag_via_string(self):
-        with self.assertNumQueries(6):  # TODO: Why so much? Check for performance improvements.
+        with self.assertNumQueries(13):  # 9 queries for the savepoint, the tag and the connection, 4 for the counter
             self.object_1.add_tag('kahLaek1em3kie2ier6n')
         with self.assertNumQueries(1):
             self.assertEqual(list(self.object_1.get_tags())[0].name, 'kahLaek1em3kie2ier6n')
@@ -41,3 +70,205 @@ class TaggedModelTest(TestCase):
 
     def test_add_new_tag_via_bad_string(self):
         self.assertRaisesMessage(TypeError, "A tag's name should contain only alphanumeric characters.", self.object_1.add_tag, 'BadString%%&&//')
+
+    def test_add_tags(self):
+        with self.assertNumQueries(13):  # 9 queries for tags and connections, 4 for three new tag usage counters
+            self.object_1.add_tags(['yegahhahraing9Udoh7c', 'Sae9aiyohxee4ahRai7u', self.tag_2])
+        with self.assertNumQueries(4):
+            self.object_1.add_tags(['yegahhahraing9Udoh7c', 'Sae9aiyohxee4ahRai7u'])
+        self.assertEqual(set(tag.name for tag in self.object_1.get_tags()),
+                         set(['iei6rair0Beeviu4ieG2', 'Sae9aiyohxee4ahRai7u', 'yegahhahraing9Udoh7c']))
+        self.assertEqual(TagConnection.objects.count(), 3)
+
+    def test_add_tags_via_bad_string(self):
+        self.assertRaisesMessage(TypeError, "A tag's name should contain only alphanumeric characters.",
+                                 self.object_1.add_tags, ['Good', 'BadString%%&&//'])
+        self.assertFalse(Tag.objects.filter(name='Good').exists())
+
+    def test_set_tags(self):
+        self.object_1.add_tags([self.tag_1, self.tag_2])
+        self.object_1.set_tags(tag for tag in ['iei6rair0Beeviu4ieG2', 'Pha5ahng0ohdaiKeez1u'])
+        self.assertEqual(set(tag.name for tag in self.object_1.get_tags()), set(['iei6rair0Beeviu4ieG2', 'Pha5ahng0ohdaiKeez1u']))
+        self.object_1.set_tags([])
+        self.assertEqual(list(self.object_1.get_tags()), [])
+
+    def test_bulk_tag(self):
+        object_2 = TestModelD.objects.create(name='oom1Zoh6eeZ4iuhaeshe')
+        self.object_1.add_tag(self.tag_1)
+        bulk_tag([self.object_1, object_2], [self.tag_1, 'Ahdeeyi2yeeNgeexoo4o'])
+        self.assertEqual(set(tag.name for tag in self.object_1.get_tags()), set(['Ahdeeyi2yeeNgeexoo4o', 'yegahhahraing9Udoh7c']))
+        self.assertEqual(set(tag.name for tag in object_2.get_tags()), set(['Ahdeeyi2yeeNgeexoo4o', 'yegahhahraing9Udoh7c']))
+        self.assertEqual(TagConnection.objects.count(), 4)
+
+    def test_tag_created_concurrently(self):
+        def create_concurrently(sender, instance, **kwargs):
+            # Simulates another process which creates the tag after the
+            # select of get_or_create_tags().
+            if instance.pk is None:
+                post_init.disconnect(sender=Tag, dispatch_uid='create_concurrently')
+                Tag.objects.create(name=instance.name)
+
+        post_init.connect(create_concurrently, sender=Tag, dispatch_uid='create_concurrently')
+        try:
+            self.object_1.add_tags(['Ohn4Chaiph', 'Quai5ieHei'])
+        finally:
+            post_init.disconnect(sender=Tag, dispatch_uid='create_concurrently')
+        self.assertEqual(set(tag.name for tag in self.object_1.get_tags()), set(['Ohn4Chaiph', 'Quai5ieHei']))
+        self.assertEqual(Tag.objects.filter(name__in=['Ohn4Chaiph', 'Quai5ieHei']).count(), 2)
+
+
+class TaggedWithTest(TestCase):
+    def setUp(self):
+        self.object_1 = TestModelD.objects.create(name='eiy0Moh5Ahphee1ohshe')
+        self.object_2 = TestModelD.objects.create(name='zu9ooNg4ieQuooz6aiqu')
+        self.object_3 = TestModelD.objects.create(name='ooPh0eec1aeshohGhooN')
+        self.object_1.add_tags(['Taglaeh7ua', 'Tagreish6j'])
+        self.object_2.add_tags(['Taglaeh7ua'])
+        self.object_3.add_tags(['Tagreish6j', 'Tagohgh8ai'])
+
+    def get_names(self, queryset):
+        return sorted(tagged_object.name for tagged_object in queryset)
+
+    def test_all(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_names(TestModelD.objects.tagged_with(all=['Taglaeh7ua', 'Tagreish6j'])),
+                             ['eiy0Moh5Ahphee1ohshe'])
+        self.assertEqual(self.get_names(TestModelD.objects.tagged_with(all=[Tag.objects.get(name='Taglaeh7ua')])),
+                         ['eiy0Moh5Ahphee1ohshe', 'zu9ooNg4ieQuooz6aiqu'])
+
+    def test_any(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_names(TestModelD.objects.tagged_with(any=['Tagreish6j', 'Tagohgh8ai'])),
+                             ['eiy0Moh5Ahphee1ohshe', 'ooPh0eec1aeshohGhooN'])
+
+    def test_all_and_any(self):
+        self.assertEqual(self.get_names(TestModelD.objects.tagged_with(all=['Tagreish6j'], any=['Taglaeh7ua', 'Tag2unknown'])),
+                         ['eiy0Moh5Ahphee1ohshe'])
+        self.assertEqual(self.get_names(TestModelD.objects.tagged_with(all=['Taglaeh7ua'], any=['Tagohgh8ai'])), [])
+
+    def test_other_model_with_same_tag(self):
+        event = Event.objects.create(title='iesh3Eegh1ohquoo3Eep', begin=now())
+        event.add_tags(['Tagohgh8ai'])
+        self.assertEqual(self.get_names(TestModelD.objects.tagged_with(all=['Tagohgh8ai'])), ['ooPh0eec1aeshohGhooN'])
+        self.assertEqual(list(Event.objects.tagged_with(all=['Tagohgh8ai'])), [event])
+
+
+class TagUsageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.object_1 = TestModelD.objects.create(name='Lai4ahcoh6aeh0ooYoo4')
+        self.object_2 = TestModelD.objects.create(name='Eeb6ahpeiXeeyahng4ai')
+        self.event = Event.objects.create(title='ohhaiGh5xa0eeP2ahngo', begin=now())
+
+    def get_count(self, name, model):
+        return TagUsage.objects.get(tag__name=name, content_type=ContentType.objects.get_for_model(model)).count
+
+    def test_counters(self):
+        self.object_1.add_tag('Countaiy7a')
+        bulk_tag([self.object_1, self.object_2, self.event], ['Countaiy7a', 'Countoo3oh'])
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 2)
+        self.assertEqual(self.get_count('Countoo3oh', TestModelD), 2)
+        self.assertEqual(self.get_count('Countaiy7a', Event), 1)
+        self.object_1.set_tags(['Countoo3oh'])
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 1)
+        self.object_2.delete()
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 0)
+        self.assertEqual(self.get_count('Countoo3oh', TestModelD), 1)
+
+    def test_counters_without_changes(self):
+        self.object_1.add_tag('Countaiy7a')
+        tag_connection = TagConnection.objects.get()
+        tag_connection.save()
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 1)
+        # A missing counter is not created for a decrease.
+        TagUsage.objects.all().delete()
+        tag_connection.delete()
+        self.assertFalse(TagUsage.objects.exists())
+
+    def test_counter_created_concurrently(self):
+        tag = Tag.objects.create(name='Countaiy7a')
+        content_type = ContentType.objects.get_for_model(TestModelD)
+
+        def create_concurrently(sender, instance, **kwargs):
+            # Simulates another process which creates the counter after the
+            # select of add_tag_usages().
+            if instance.pk is None:
+                post_init.disconnect(sender=TagUsage, dispatch_uid='create_concurrently')
+                TagUsage.objects.create(tag=tag, content_type=content_type, count=0)
+
+        post_init.connect(create_concurrently, sender=TagUsage, dispatch_uid='create_concurrently')
+        try:
+            add_tag_usages({(tag.pk, content_type.pk): 2})
+        finally:
+            post_init.disconnect(sender=TagUsage, dispatch_uid='create_concurrently')
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 2)
+
+    def test_delete_tag(self):
+        self.object_1.add_tags(['Countaiy7a'])
+        Tag.objects.get(name='Countaiy7a').delete()
+        self.assertFalse(TagUsage.objects.exists())
+
+    def test_tag_cloud(self):
+        bulk_tag([self.object_1, self.object_2], ['Cloudeiph7', 'Cloudah4ie'])
+        self.event.add_tags(['Cloudeiph7', 'Suggestion'])
+        self.assertEqual(get_tag_cloud(), [('Cloudah4ie', 2), ('Cloudeiph7', 3), ('Suggestion', 1)])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_tag_cloud(), [('Cloudah4ie', 2), ('Cloudeiph7', 3), ('Suggestion', 1)])
+        self.assertEqual(get_tag_cloud(Event), [('Cloudeiph7', 1), ('Suggestion', 1)])
+        self.assertEqual(get_tag_suggestions('cLOUD'), ['Cloudeiph7', 'Cloudah4ie'])
+        self.assertEqual(get_tag_suggestions('cloud', limit=1), ['Cloudeiph7'])
+        self.assertEqual(get_tag_suggestions('s', model=Event), ['Suggestion'])
+        self.event.add_tags(['Cloudah4ie'])
+        self.assertEqual(get_tag_cloud(Event), [('Cloudah4ie', 1), ('Cloudeiph7', 1), ('Suggestion', 1)])
+
+    def test_rebuild_tag_usages(self):
+        self.object_1.add_tags(['Countaiy7a'])
+        TagConnection.objects.bulk_create([
+            TagConnection(tag=Tag.objects.get(name='Countaiy7a'), content_object=self.object_2)])
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 1)
+        call_command('rebuild_tag_usages', stdout=StringIO())
+        self.assertEqual(self.get_count('Countaiy7a', TestModelD), 2)
+        self.assertEqual(get_tag_cloud(), [('Countaiy7a', 2)])
+
+
+class TagIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.object_1 = TestModelD.objects.create(name='Oongae1Eiph8ahv4eiXe')
+        self.object_2 = TestModelD.objects.create(name='Iecho7ohmo0Eishoh1ai')
+        bulk_tag([self.object_1, self.object_2], ['Indexoo4ai'])
+        self.object_1.add_tags(['indexEeg6u', 'Otheeg5Aiv'])
+        Tag.objects.create(name='Indexah0Ie')
+
+    def test_search(self):
+        self.assertEqual(tag_index.search('INDEX'), ['Indexoo4ai', 'indexEeg6u', 'Indexah0Ie'])
+        with self.assertNumQueries(0):
+            self.assertEqual(tag_index.search('index', limit=2), ['Indexoo4ai', 'indexEeg6u'])
+            self.assertEqual(tag_index.search('indexe'), ['indexEeg6u'])
+            self.assertEqual(tag_index.search('Indexu'), [])
+            self.assertEqual(tag_index.search('i', limit=1), ['Indexoo4ai'])
+            self.assertEqual(tag_index.search('O'), ['Otheeg5Aiv'])
+
+    def test_reload_on_change(self):
+        self.assertEqual(tag_index.search('index'), ['Indexoo4ai', 'indexEeg6u', 'Indexah0Ie'])
+        Tag.objects.create(name='Indexaeb3o')
+        with self.assertNumQueries(1):  # Only the new tag
+            self.assertEqual(tag_index.search('index'), ['Indexoo4ai', 'indexEeg6u', 'Indexaeb3o', 'Indexah0Ie'])
+        self.object_2.add_tags(['Indexah0Ie', 'indexEeg6u'])
+        self.object_1.add_tags(['Indexah0Ie'])
+        with self.assertNumQueries(1):  # Only the tags with changed counters
+            self.assertEqual(tag_index.search('index', limit=2), ['Indexah0Ie', 'indexEeg6u'])
+        Tag.objects.get(name='Indexah0Ie').delete()
+        self.assertEqual(tag_index.search('index', limit=2), ['indexEeg6u', 'Indexoo4ai'])
+        tag = Tag.objects.get(name='Indexoo4ai')
+        tag.name = 'Renamed0ie'
+        tag.save()
+        self.assertEqual(tag_index.search('index', limit=2), ['indexEeg6u', 'Indexaeb3o'])
+        self.assertEqual(tag_index.search('renamed'), ['Renamed0ie'])
+
+    def test_autocomplete_view(self):
+        tag_index.search('index')
+        with self.assertNumQueries(0):
+            response = Client().get('/tags/autocomplete/', {'q': 'inDEX'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content.decode()), ['Indexoo4ai', 'indexEeg6u', 'Indexah0Ie'])
@@ -1,4 +1,15 @@
+import warnings
+
 from ophrys_custom.settings import *
 
 
 INSTALLED_APPS += ('tests',)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# The tests run in one process, so the process-local cache is fine.
+warnings.filterwarnings('ignore', 'The cache backend LocMemCache is not shared by all processes', RuntimeWarning)
@@ -7,7 +7,9 @@ test_model_a_urlpatterns = patterns(
     '',
     url(r'^ohl9pheengooLai0noo1/', 'some_view', name='list'),
     url(r'^ahquee1daiQuo7wei0le/(?P<pk>\d+)/', 'some_view', name='detail'),
-    url(r'^lahQuo2pheeM0iech7ku/(?P<pk>\d+)/', 'some_view', name='update'))
+    url(r'^lahQuo2pheeM0iech7ku/(?P<pk>\d+)/', 'some_view', name='update'),
+    url(r'^Aeph6ohyaetah5Eizoo3/(?P<pk>\d{1,9})/', 'some_view', name='delete'),
+    url(r'^314159265358979323846/(?P<pk>\d+)/', 'some_view', name='history'))
 
 
 test_model_b_urlpatterns = patterns(
@@ -20,7 +22,7 @@ test_model_urlpatterns = patterns(
     '',
     url(r'^test_model_a/', include(test_model_a_urlpatterns, namespace='TestModelA')),
     url(r'^test_model_b/', include(test_model_b_urlpatterns, namespace='TestModelB')),
-    url(r'^test_model_c/', include(TestModelC().urls)))
+    url(r'^test_model_c/', include(TestModelC.urls)))
 
 
 urlpatterns = patterns(
@@ -0,0 +1,40 @@
+import tempfile
+import warnings
+
+from django.core.cache import cache, get_cache
+from django.test import TestCase
+
+from ophrys.utils.cache import check_cache_backend, get_version, get_versions
+
+
+class CheckCacheBackendTest(TestCase):
+    def test_process_local_cache(self):
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            check_cache_backend()
+        self.assertEqual(len(caught_warnings), 1)
+        self.assertIn('LocMemCache is not shared by all processes', str(caught_warnings[0].message))
+
+    def test_shared_cache(self):
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            check_cache_backend(get_cache('django.core.cache.backends.filebased.FileBasedCache', LOCATION=tempfile.gettempdir()))
+        self.assertEqual(caught_warnings, [])
+
+    def test_check_on_first_use(self):
+        cache.delete('ophrys.tests.version')
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            version = get_version('ophrys.tests.version')
+            self.assertEqual(get_version('ophrys.tests.version'), version)
+        self.assertEqual(len(caught_warnings), 1)
+
+
+class GetVersionsTest(TestCase):
+    def test_get_versions(self):
+        cache.delete_many(['ophrys.tests.version_1', 'ophrys.tests.version_2'])
+        version_1 = get_version('ophrys.tests.version_1')
+        versions = get_versions('ophrys.tests.version_1', 'ophrys.tests.version_2')
+        self.assertEqual(versions, (version_1, get_version('ophrys.tests.version_2')))
+        self.assertNotEqual(versions[0], versions[1])
+        self.assertEqual(get_versions('ophrys.tests.version_2', 'ophrys.tests.version_1'), versions[::-1])
@@ -1,5 +1,9 @@
+from django.core.cache import cache
 from django.test import TestCase
 
+from ophrys.utils.cache import get_last_modified_key
+from ophrys.utils.models import absolute_url_cache
+
 from tests.models import TestModelA, TestModelB, TestModelC
 
 
@@ -15,11 +19,38 @@ class GetAbsoluteUrlMixinTest(TestCase):
         self.assertEqual(test_object.get_absolute_url(), '/test_model/test_model_a/ahquee1daiQuo7wei0le/1/')
         self.assertEqual(test_object.get_absolute_url(url_name='update'), '/test_model/test_model_a/lahQuo2pheeM0iech7ku/1/')
 
+    def test_reverse_via_pk_without_url_template(self):
+        test_object = TestModelA.objects.create()
+        self.assertEqual(test_object.get_absolute_url(url_name='delete'), '/test_model/test_model_a/Aeph6ohyaetah5Eizoo3/1/')
+        self.assertEqual(test_object.get_absolute_url(url_name='history'), '/test_model/test_model_a/314159265358979323846/1/')
+
     def test_reverse_via_slug(self):
         test_object = TestModelB.objects.create(slug='kel7EiMaek2thahf8aoy')
         self.assertEqual(test_object.get_absolute_url(), '/test_model/test_model_b/Udaicae3EiKai8eiveif/kel7EiMaek2thahf8aoy/')
         self.assertEqual(test_object.get_absolute_url(url_name='update'), '/test_model/test_model_b/xoorumi8Thei5ayei5io/kel7EiMaek2thahf8aoy/')
 
+    def test_cache(self):
+        absolute_url_cache.clear()
+        object_1 = TestModelA.objects.create()
+        object_2 = TestModelA.objects.create()
+        object_3 = TestModelB.objects.create(slug='Ahngoh2eeQu4ooy5iexa')
+        self.assertEqual(object_1.get_absolute_url(), '/test_model/test_model_a/ahquee1daiQuo7wei0le/1/')
+        self.assertEqual(object_2.get_absolute_url(), '/test_model/test_model_a/ahquee1daiQuo7wei0le/2/')
+        self.assertEqual(object_3.get_absolute_url(), '/test_model/test_model_b/Udaicae3EiKai8eiveif/Ahngoh2eeQu4ooy5iexa/')
+        self.assertEqual(object_1.get_absolute_url('list'), '/test_model/test_model_a/ohl9pheengooLai0noo1/')
+        self.assertEqual(
+            sorted((key[0].__name__, key[1], value[0]) for key, value in absolute_url_cache.items()),
+            [('TestModelA', 'detail', 'pk'), ('TestModelA', 'list', None), ('TestModelB', 'detail', 'slug')])
+        self.assertEqual(
+            [value[2] for key, value in absolute_url_cache.items() if key[0] is TestModelA and key[1] == 'detail'],
+            ['/test_model/test_model_a/ahquee1daiQuo7wei0le/%d/'])
+
+    def test_unsaved_object_is_not_cached(self):
+        absolute_url_cache.clear()
+        self.assertRaises(AttributeError, TestModelA().get_absolute_url)
+        self.assertEqual(absolute_url_cache, {})
+        self.assertEqual(TestModelA.objects.create().get_absolute_url(), '/test_model/test_model_a/ahquee1daiQuo7wei0le/1/')
+
 
 class AutoModelMixinTest(TestCase):
     def test_get_view_class(self):
@@ -29,3 +60,22 @@ class AutoModelMixinTest(TestCase):
             'The view name "UnknownViewClass_xaa7tooleingaWo0rah8" is unknown.',
             test_object.get_view_class,
             'UnknownViewClass_xaa7tooleingaWo0rah8')
+
+    def test_last_modified(self):
+        cache.delete_many([get_last_modified_key(TestModelA), get_last_modified_key(TestModelC)])
+        TestModelA.objects.create()
+        self.assertIsNone(cache.get(get_last_modified_key(TestModelA)))
+        test_object = TestModelC.objects.create(name='Ohch4ohgho')
+        last_modified = cache.get(get_last_modified_key(TestModelC))
+        self.assertIsNotNone(last_modified)
+        test_object.delete()
+        self.assertGreaterEqual(cache.get(get_last_modified_key(TestModelC)), last_modified)
+
+    def test_urls_are_built_once(self):
+        urlpatterns, app_name, namespace = TestModelC.urls
+        self.assertIsNone(app_name)
+        self.assertEqual(namespace, 'TestModelC')
+        self.assertIs(TestModelC.urls[0], urlpatterns)
+        self.assertIs(TestModelC().urls[0], urlpatterns)
+        self.assertIs(TestModelC.get_view('Detail'), urlpatterns[2].callback)
+        self.assertEqual(TestModelC.get_view('Delete').__name__, 'Delete')
@@ -1,6 +1,11 @@
+import json
+
+from django.http import Http404
 from django.template import TemplateDoesNotExist
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
+
+from ophrys.utils.views import ExportView, KeysetListView
 
 from tests.models import TestModelC
 
@@ -24,6 +29,13 @@ class AutoModelMixinViewsTest(TestCase):
         TestModelC.objects.create(name='AiwaiB5oheez1UJajeip')
         self.assertRaisesMessage(TemplateDoesNotExist, 'tests/testmodelc_detail.html', self.client.get, '/test_model/test_model_c/1/')
 
+    def test_detail_view_post(self):
+        TestModelC.objects.create(name='ooK9eeghoh6Phaeghai2')
+        # Only GET and HEAD requests are conditional.
+        response = self.client.post('/test_model/test_model_c/1/', {})
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(response.has_header('ETag'))
+
     def test_update_view(self):
         TestModelC.objects.create(name='Luph3tohquoesai2haLa')
         self.assertRaisesMessage(TemplateDoesNotExist, 'tests/testmodelc_form.html', self.client.get, '/test_model/test_model_c/1/update/')
@@ -39,3 +51,44 @@ class AutoModelMixinViewsTest(TestCase):
         response = self.client.post('/test_model/test_model_c/1/delete/', {})
         self.assertEqual(response.url, 'http://testserver/test_model/test_model_c/')
         self.assertFalse(TestModelC.objects.filter(name='Zah6ceiGiu0ahf7ouH4h').exists())
+
+
+class KeysetListViewTest(TestCase):
+    def test_ordering_fields(self):
+        options = TestModelC._meta
+        view = KeysetListView(model=TestModelC)
+        self.assertEqual(view.get_ordering_fields(), [(options.pk, False)])
+        ordering = options.ordering
+        options.ordering = ['-pk']
+        try:
+            self.assertEqual(view.get_ordering_fields(), [(options.pk, True)])
+        finally:
+            options.ordering = ordering
+
+
+class ExportViewTest(TestCase):
+    urls = 'tests.urls'
+
+    def setUp(self):
+        TestModelC.objects.bulk_create([TestModelC(name='Name_%d' % number) for number in range(5)])
+        self.view = ExportView.as_view(model=TestModelC, chunk_size=2)
+        self.request = RequestFactory().get('/export/')
+
+    def test_csv(self):
+        response = self.view(self.request, format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="testmodelc.csv"')
+        with self.assertNumQueries(3):
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content, 'id,name\r\n1,Name_0\r\n2,Name_1\r\n3,Name_2\r\n4,Name_3\r\n5,Name_4\r\n')
+
+    def test_jsonl(self):
+        response = self.view(self.request, format='jsonl')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'id': number + 1, 'name': 'Name_%d' % number} for number in range(5)])
+
+    def test_unsupported_format(self):
+        self.assertRaises(Http404, self.view, self.request, format='ics')
+
+    def test_no_export_route(self):
+        self.assertEqual(Client().get('/test_model/test_model_c/export.csv').status_code, 404)